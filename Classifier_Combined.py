@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import os, dotenv
+
+from classifier.core import load_axis, main
+
+# Load environment variables from a .env file
+dotenv.load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+
+input_csv_path = "Manualcodingoutput.csv"
+model_string = "gpt-4-0125-preview"
+model_name_suffix = "gpt4"
+output_csv_path = f"COMBINED_model_responses_{model_name_suffix}.csv"
+
+# Classify Axis 1 (Purpose) and Axis 2 (Action) in a single request per row
+axes = [load_axis("axis1"), load_axis("axis2")]
+
+
+if __name__ == "__main__":
+    main(axes, input_csv_path, output_csv_path, model_string, OPENAI_API_KEY)
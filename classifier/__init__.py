@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# Shared helpers used by Classifier_Axis1.py and Classifier_Axis2.py
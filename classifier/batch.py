@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+from classifier.engine import RequestFailure
+from classifier.usage import BATCH_DISCOUNT, UsageTracker
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Batch API input file limits: requests per batch, and bytes per file (200 MB,
+# less a margin)
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+
+# Runs chat completion requests through the Batch API instead of one call per
+# row. Exposes the same `model` / `run(message_lists)` interface as
+# AsyncClassificationEngine, so it can be used with complete_with_cache.
+# Requests beyond one batch's limits are split over several batch jobs, which
+# run at the same time.
+class BatchRunner:
+    def __init__(
+        self,
+        model,
+        batch_path="batch_input.jsonl",
+        poll_interval=60,
+        api_key=None,
+        base_url=None,
+        client=None,
+        **request_kwargs,
+    ):
+        self.model = model
+        self.batch_path = batch_path
+        self.poll_interval = poll_interval
+        self.client = client or OpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+        )
+        self.request_kwargs = request_kwargs
+        self.usage = UsageTracker(model, discount=BATCH_DISCOUNT)
+
+    # The first input file is batch_path, later ones batch_path with .partK
+    def part_path(self, index):
+        if not index:
+            return self.batch_path
+        stem, extension = os.path.splitext(self.batch_path)
+        return f"{stem}.part{index}{extension}"
+
+    # Write one request per line, starting a new file whenever the next request
+    # would take the current one past the request or byte limit. custom_id
+    # carries the input position. Returns the paths written.
+    def write_batch_files(self, message_lists):
+        paths = []
+        batch_file = None
+        requests, size = 0, 0
+        try:
+            for i, messages in enumerate(message_lists):
+                request = {
+                    "custom_id": f"row-{i}",
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {
+                        "model": self.model,
+                        "messages": messages,
+                        **self.request_kwargs,
+                    },
+                }
+                line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+                if (
+                    batch_file is None
+                    or requests == MAX_BATCH_REQUESTS
+                    or size + len(line) > MAX_BATCH_BYTES
+                ):
+                    if batch_file is not None:
+                        batch_file.close()
+                    paths.append(self.part_path(len(paths)))
+                    batch_file = open(paths[-1], mode="wb")
+                    requests, size = 0, 0
+                batch_file.write(line)
+                requests += 1
+                size += len(line)
+        finally:
+            if batch_file is not None:
+                batch_file.close()
+        return paths
+
+    def submit(self, path):
+        with open(path, mode="rb") as batch_file:
+            input_file = self.client.files.create(file=batch_file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        print(f"Submitted batch {batch.id} ({path})")
+        return batch
+
+    def wait(self, batch):
+        while batch.status not in FINISHED_STATUSES:
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts:
+                print(
+                    f"Batch {batch.id}: {batch.status}, "
+                    f"{counts.completed}/{counts.total} completed, "
+                    f"{counts.failed} failed"
+                )
+        if batch.status != "completed":
+            # Expired and cancelled batches still have output for the rows
+            # they finished; the rest fail per row and are retried on --resume
+            print(
+                f"Batch {batch.id} finished with status {batch.status}; "
+                "rows without output are logged as failures"
+            )
+        return batch
+
+    # Parse a batch's output file back into ChatCompletion objects, stored in
+    # `responses` at their input positions. Rows that errored come back as
+    # RequestFailure, like requests that failed in the concurrent engine.
+    def read_results(self, batch, responses):
+        if not batch.output_file_id:
+            return
+        output = self.client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            index = int(result["custom_id"].split("-", 1)[1])
+            if result.get("error") or response.get("status_code") != 200:
+                error = result.get("error") or response.get("body")
+                responses[index] = RequestFailure(RuntimeError(str(error)), 1)
+                continue
+            responses[index] = ChatCompletion.model_validate(response["body"])
+            self.usage.record(responses[index])
+
+    # Rows missing from every output (e.g. of an expired batch) stay failures
+    def run(self, message_lists):
+        missing = RequestFailure(RuntimeError("missing from the batch output"), 1)
+        responses = [missing] * len(message_lists)
+        batches = [self.submit(path) for path in self.write_batch_files(message_lists)]
+        for batch in batches:
+            self.read_results(self.wait(batch), responses)
+        return responses
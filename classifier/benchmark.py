@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# End-to-end benchmark of the classifier scripts against the local mock server.
+# The mock answers every synthetic row with its gold label, after a latency
+# drawn from the chosen distribution, and fails a share of requests. Each
+# script runs as its own process over synthetic inputs of each size; rows/sec,
+# peak RSS, client-side tail latency and failures are written as JSON.
+#
+#   python -m classifier.benchmark --sizes 1000,10000 --output bench.json
+#   python -m classifier.benchmark --baseline bench.json   # fails on regressions
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from classifier.core import load_axis
+from classifier.mock_server import LATENCY_DISTRIBUTIONS, start_mock_server
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Script, the axis it classifies and its output file, relative to its cwd
+SCRIPTS = {
+    "Classifier_Axis1.py": ("axis1", "model_responses_gpt4.csv"),
+    "Classifier_Axis2.py": ("axis2", "AXIS_2model_responses_gpt4.csv"),
+}
+
+# The classifier scripts read this file from their working directory
+INPUT_FILE_NAME = "Manualcodingoutput.csv"
+
+TOPICS = ["노트북", "제주도 여행", "전기차 보조금", "파이썬 비동기", "김치찌개", "주식 배당"]
+FOLLOW_UPS = ["더 자세히 알려줘", "가격은 얼마야?", "표로 정리해줘", "다른 추천은?", "그게 맞아?"]
+
+LATENCY_LINE = re.compile(r"^Latency: p50 ([\d.]+)s, p95 ([\d.]+)s, p99 ([\d.]+)s$")
+ACCURACY_LINE = re.compile(r"^Accuracy: ([\d.]+)%$")
+
+# Lower is better for these result keys, higher for rows_per_second
+REGRESSION_KEYS = {
+    "rows_per_second": False,
+    "peak_rss_mb": True,
+    "latency_p99": True,
+}
+
+
+# Function to write `rows` synthetic log excerpts with random gold codes for
+# both axes. Returns {query: {axis name: gold label}} for the mock server.
+def write_synthetic_input(path, rows, axes, seed=0):
+    rng = random.Random(seed)
+    answers = {}
+    with open(path, mode="w", encoding="utf-8", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["query"] + [axis.gold_column for axis in axes])
+        for row_id in range(rows):
+            topic = rng.choice(TOPICS)
+            query = (
+                f"Q1: {topic} 추천해줘 ({row_id})\n"
+                f"R: {topic}에 대한 답변입니다.\n"
+                f"Q2: {rng.choice(FOLLOW_UPS)}"
+            )
+            labels = {axis.name: rng.choice(list(axis.labels)) for axis in axes}
+            writer.writerow([query] + [axis.labels[labels[axis.name]] for axis in axes])
+            answers[query] = labels
+    return answers
+
+
+# Function to run a command and return (seconds, exit code, peak RSS in MB).
+# os.wait4 reports the resource usage of that one child process.
+def run_measured(command, cwd, env, log_path):
+    with open(log_path, mode="w", encoding="utf-8") as log_file:
+        started = time.monotonic()
+        process = subprocess.Popen(
+            command, cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.monotonic() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux
+    return seconds, process.returncode, usage.ru_maxrss / 1024
+
+
+# Function to read the accuracy and latency percentiles a run printed
+def parse_run_log(log_path):
+    parsed = {}
+    with open(log_path, mode="r", encoding="utf-8") as log_file:
+        for line in log_file:
+            line = line.rstrip("\n")
+            latency = LATENCY_LINE.match(line)
+            if latency:
+                parsed["latency_p50"], parsed["latency_p95"], parsed["latency_p99"] = (
+                    float(value) for value in latency.groups()
+                )
+            accuracy = ACCURACY_LINE.match(line)
+            if accuracy:
+                parsed["accuracy"] = float(accuracy.group(1)) / 100
+    return parsed
+
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, mode="rb") as f:
+        return sum(1 for _ in f)
+
+
+def run_benchmark(sizes, script_names, server_options, script_args, workdir):
+    axes = [load_axis("axis1"), load_axis("axis2")]
+    results = []
+    for rows in sizes:
+        input_path = os.path.join(workdir, INPUT_FILE_NAME)
+        answers = write_synthetic_input(input_path, rows, axes)
+        for script in script_names:
+            axis_name, output_name = SCRIPTS[script]
+            # Single-axis requests are answered with this script's axis only
+            script_answers = {
+                query: {axis_name: labels[axis_name]}
+                for query, labels in answers.items()
+            }
+            server = start_mock_server(answers=script_answers, **server_options)
+            env = dict(
+                os.environ,
+                OPENAI_BASE_URL=server.base_url,
+                OPENAI_API_KEY="benchmark",
+                PYTHONPATH=REPO_DIR,
+            )
+            command = [sys.executable, os.path.join(REPO_DIR, script), *script_args]
+            log_path = os.path.join(workdir, f"{script}.{rows}.log")
+            print(f"Running {script} on {rows} rows")
+            seconds, exit_code, peak_rss_mb = run_measured(
+                command, workdir, env, log_path
+            )
+            server.shutdown()
+            server.server_close()
+            failed_rows = count_lines(
+                os.path.join(workdir, f"{output_name}.failures.jsonl")
+            )
+            result = {
+                "script": script,
+                "axis": axis_name,
+                "rows": rows,
+                "exit_code": exit_code,
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(rows / seconds, 2),
+                "peak_rss_mb": round(peak_rss_mb, 1),
+                "requests": server.request_count,
+                "injected_errors": server.error_count,
+                "failed_rows": failed_rows,
+                **parse_run_log(log_path),
+            }
+            print(json.dumps(result))
+            results.append(result)
+    return results
+
+
+# Function to list results that are worse than the baseline run of the same
+# script and size by more than `tolerance` (a fraction)
+def find_regressions(results, baseline, tolerance):
+    previous = {(r["script"], r["rows"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["script"], result["rows"]))
+        if old is None:
+            continue
+        for key, lower_is_better in REGRESSION_KEYS.items():
+            if result.get(key) is None or not old.get(key):
+                continue
+            change = (result[key] - old[key]) / old[key]
+            if (change if lower_is_better else -change) > tolerance:
+                regressions.append(
+                    f"{result['script']} {result['rows']} rows: {key} "
+                    f"{old[key]} -> {result[key]} ({change:+.1%})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the classifier scripts")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS))
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument(
+        "--distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument(
+        "--script-args",
+        default="--no-cache --concurrency 64",
+        help="arguments passed to each classifier script",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results JSON to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed relative regression"
+    )
+    parser.add_argument("--workdir", help="keep inputs, outputs and logs here")
+    args = parser.parse_args()
+
+    server_options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "distribution": args.distribution,
+        "error_rate": args.error_rate,
+    }
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        workdir = args.workdir or temporary_dir
+        os.makedirs(workdir, exist_ok=True)
+        results = run_benchmark(
+            [int(size) for size in args.sizes.split(",")],
+            args.scripts.split(","),
+            server_options,
+            args.script_args.split(),
+            workdir,
+        )
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "server": server_options,
+        "script_args": args.script_args,
+        "results": results,
+    }
+    with open(args.output, mode="w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, mode="r", encoding="utf-8") as baseline_file:
+            regressions = find_regressions(
+                results, json.load(baseline_file), args.tolerance
+            )
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
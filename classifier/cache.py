@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import sqlite3
+import time
+
+from classifier.engine import RequestFailure, ScoredText, extract_response_text
+
+# Seconds to wait for another process (e.g. another --shards worker) holding
+# the database lock before a write gives up
+BUSY_TIMEOUT_SECONDS = 60
+
+
+# On-disk response cache backed by SQLite. Entries are keyed on a hash of the
+# model string, the full message list (system prompt, few-shot messages and
+# query) and any extra request options, so any change to the prompt or the
+# output mode automatically misses the cache. Entries may also carry the
+# row_tag of the input row they answer, so every answer cached for a row can
+# be dropped when a human relabels it.
+class ResponseCache:
+    def __init__(self, path, max_entries=None, max_age_days=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                logprobs TEXT,
+                row_tag TEXT
+            )"""
+        )
+        # Caches created before logprobs or row tags were stored lack the columns
+        columns = {
+            row[1] for row in self.connection.execute("PRAGMA table_info(responses)")
+        }
+        for column in ("logprobs", "row_tag"):
+            if column not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE responses ADD COLUMN {column} TEXT"
+                )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_row_tag ON responses (row_tag)"
+        )
+        self.evict()
+
+    # Without options the key is the same as for caches written before options
+    # were part of it, so existing entries stay valid
+    @staticmethod
+    def make_key(model, messages, options=None):
+        key_parts = [model, messages] + ([options] if options else [])
+        payload = json.dumps(key_parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Tag of an input row, from its raw query text
+    @staticmethod
+    def row_tag(query):
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at):
+        if not self.max_age_days:
+            return False
+        return time.time() - created_at > self.max_age_days * 86400
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT response, created_at, logprobs FROM responses WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        if row[2]:
+            return ScoredText(row[0], [tuple(pair) for pair in json.loads(row[2])])
+        return row[0]
+
+    def put(self, key, model, response, row_tag=None):
+        now = time.time()
+        token_logprobs = getattr(response, "token_logprobs", None)
+        self.connection.execute(
+            """INSERT OR REPLACE INTO responses
+                (key, model, response, created_at, last_used, logprobs, row_tag)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (
+                key,
+                model,
+                str(response),
+                now,
+                now,
+                json.dumps(token_logprobs) if token_logprobs else None,
+                row_tag,
+            ),
+        )
+
+    # Drop every cached answer for the given rows. Returns the entries removed.
+    def invalidate_rows(self, row_tags):
+        removed = 0
+        for tag in row_tags:
+            removed += self.connection.execute(
+                "DELETE FROM responses WHERE row_tag = ?", (tag,)
+            ).rowcount
+        self.connection.commit()
+        return removed
+
+    # Drop entries older than max_age_days, then the least recently used ones
+    # beyond max_entries
+    def evict(self):
+        if self.max_age_days:
+            cutoff = time.time() - self.max_age_days * 86400
+            self.connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (cutoff,)
+            )
+        if self.max_entries:
+            self.connection.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC
+                    LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+        self.connection.commit()
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        print(
+            f"Cache: {self.hits} hits, {self.misses} misses ({hit_rate:.2%} hit rate)"
+        )
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+
+# Run the message lists through the engine, answering from the cache where
+# possible. Returns the response texts in input order, with a RequestFailure
+# for rows whose request failed (these are never cached). When the same
+# messages are sampled repeatedly, `samples` gives each one's sample index so
+# every sample gets its own cache entry. `row_tags` tags each new entry with
+# the row it answers (see ResponseCache.row_tag).
+def complete_with_cache(engine, message_lists, cache=None, samples=None, row_tags=None):
+    response_texts = [None] * len(message_lists)
+    options = [engine.request_kwargs] * len(message_lists)
+    if samples is not None:
+        options = [dict(engine.request_kwargs, sample=sample) for sample in samples]
+    keys = [
+        ResponseCache.make_key(engine.model, messages, request_options)
+        for messages, request_options in zip(message_lists, options)
+    ]
+    if cache is not None:
+        response_texts = [cache.get(key) for key in keys]
+        # Hits update last_used; commit them now so the write lock is not held
+        # through the requests below while other workers want to write
+        cache.connection.commit()
+
+    pending = [i for i, text in enumerate(response_texts) if text is None]
+    responses = engine.run([message_lists[i] for i in pending]) if pending else []
+    for i, response in zip(pending, responses):
+        response_texts[i] = extract_response_text(response)
+        # Refusals are failures too, so check the extracted text
+        failed = isinstance(response_texts[i], RequestFailure)
+        if cache is not None and not failed and response.choices:
+            row_tag = row_tags[i] if row_tags else None
+            cache.put(keys[i], engine.model, response_texts[i], row_tag)
+
+    if cache is not None:
+        cache.connection.commit()
+    return response_texts
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Parquet and Arrow IPC input and output. Inputs are streamed in record
+# batches reading only the requested columns. Outputs are a directory of part
+# files, one per checkpointed chunk, so a crash never leaves a half-written
+# file behind and --resume only adds parts. Output rows reference the input by
+# row_id instead of repeating the query text.
+import glob
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+# Rows per record batch read from an input file
+BATCH_SIZE = 10000
+
+
+def is_parquet(path):
+    return path.lower().endswith(PARQUET_EXTENSIONS)
+
+
+# Function to yield the record batches of one Parquet or Arrow IPC file,
+# projected to `columns` (all columns when None)
+def iter_file_batches(path, columns=None):
+    if is_parquet(path):
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        yield from parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=columns)
+        return
+    with pa.memory_map(path) as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            # Not the file format, so read it as an IPC stream
+            source.seek(0)
+            batches = pa.ipc.open_stream(source)
+        for batch in batches:
+            yield batch if columns is None else batch.select(columns)
+
+
+# Part files of an output directory in write order; a plain file is its own
+# single part
+def part_paths(path):
+    if not os.path.isdir(path):
+        return [path]
+    extension = os.path.splitext(path)[1]
+    return sorted(glob.glob(os.path.join(path, f"part-*{extension}")))
+
+
+def iter_record_batches(path, columns=None):
+    for part_path in part_paths(path):
+        yield from iter_file_batches(part_path, columns)
+
+
+# Function to stream rows as dicts of strings, like csv.DictReader does, so
+# numeric gold codes compare equal to the label codes. Nulls become "".
+def read_columnar_rows(path, columns):
+    for batch in iter_record_batches(path, columns):
+        values = [
+            pc.fill_null(pc.cast(column, pa.string()), "").to_pylist()
+            for column in batch.columns
+        ]
+        for row in zip(*values):
+            yield dict(zip(columns, row))
+
+
+# Parquet keeps row counts in its footer; Arrow batches are memory-mapped, so
+# counting their rows reads no column data
+def count_columnar_rows(path):
+    rows = 0
+    for part_path in part_paths(path):
+        if is_parquet(part_path):
+            rows += pq.ParquetFile(part_path, memory_map=True).metadata.num_rows
+        else:
+            rows += sum(batch.num_rows for batch in iter_file_batches(part_path))
+    return rows
+
+
+def column_names(path):
+    first_part = part_paths(path)[0]
+    if is_parquet(first_part):
+        return pq.read_schema(first_part, memory_map=True).names
+    return next(iter_file_batches(first_part)).schema.names
+
+
+# Function to read the given columns of a file or output directory into one
+# table; the record batches are kept as they are, without copying
+def read_columnar_table(path, columns):
+    batches = list(iter_record_batches(path, columns))
+    if not batches:
+        return pa.table({column: pa.array([], pa.string()) for column in columns})
+    return pa.Table.from_batches(batches)
+
+
+# Writes classified rows as numbered part files in the `output_path`
+# directory. Every column is a string except the correctness flags, which are
+# booleans. The query is left out: rows are joined back to the input by
+# row_id. A part is written under a temporary name and renamed when complete.
+class ColumnarResultWriter:
+    def __init__(self, output_path, fieldnames, score_columns, resume=False):
+        self.output_path = output_path
+        self.extension = os.path.splitext(output_path)[1]
+        self.schema = pa.schema(
+            [
+                (name, pa.bool_() if name in score_columns else pa.string())
+                for name in fieldnames
+                if name != "query"
+            ]
+        )
+        os.makedirs(output_path, exist_ok=True)
+        existing = part_paths(output_path)
+        if not resume:
+            for path in existing:
+                os.remove(path)
+            existing = []
+        self.part_count = len(existing)
+
+    def _value(self, field, value):
+        if value is None or value == "":
+            return None
+        if pa.types.is_boolean(field.type):
+            return bool(value)
+        return str(value)
+
+    def write_rows(self, items):
+        if not items:
+            return
+        batch = pa.RecordBatch.from_pydict(
+            {
+                field.name: [self._value(field, item.get(field.name)) for item in items]
+                for field in self.schema
+            },
+            schema=self.schema,
+        )
+        path = os.path.join(
+            self.output_path, f"part-{self.part_count:05d}{self.extension}"
+        )
+        temporary_path = f"{path}.tmp"
+        if is_parquet(path):
+            pq.write_table(pa.Table.from_batches([batch]), temporary_path)
+        else:
+            with pa.ipc.new_file(temporary_path, self.schema) as writer:
+                writer.write_batch(batch)
+        os.replace(temporary_path, path)
+        self.part_count += 1
+
+    def close(self):
+        pass
@@ -0,0 +1,871 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import re
+
+from classifier.batch import MAX_BATCH_REQUESTS, BatchRunner
+from classifier.cache import ResponseCache, complete_with_cache
+from classifier.engine import AsyncClassificationEngine, RequestFailure
+from classifier.excerpts import parse_excerpt, widest_compressor
+from classifier.labels import LabelMatcher
+from classifier.metrics import RunMetrics
+from classifier.packing import CODE_FENCE, complete_packed, report_packing
+from classifier.pipeline import count_rows, is_columnar, read_rows, run_pipeline
+from classifier.sharding import read_csv_shard, run_sharded, shard_output_path
+from classifier.structured import (
+    OUTPUT_MODES,
+    answer_probabilities,
+    output_mode_request_kwargs,
+    output_mode_system_prompt,
+)
+from classifier.voting import SelfConsistencyVoter
+
+AXES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "axes")
+
+cache_path = "response_cache.sqlite"
+cache_max_entries = 500000
+cache_max_age_days = 90
+
+# Prepended when several axes are classified in a single request
+COMBINED_INSTRUCTIONS = """You will classify the same excerpt of a conversational search log along {count} independent axes. The instructions for each axis follow, each under its own "Axis:" heading. Apply each axis's instructions on their own, then reply only with a JSON object that maps each axis name to your answer for that axis, for example {example}.
+"""
+
+# The line after which an axis prompt lists its inline examples
+INLINE_EXAMPLES_HEADING = re.compile(r"^Follow the examples\b.*$", re.MULTILINE)
+
+# Follow-up sent once for answers that do not match any label (--requery-unparsed)
+REQUERY_INSTRUCTIONS = """Your answer could not be matched to a label. Reply only with exactly one of these labels and nothing else: {labels}"""
+
+REQUERY_COMBINED_INSTRUCTIONS = """Your answer could not be matched to a label for every axis. Reply only with a JSON object that maps each axis name to exactly one of its labels: {labels}"""
+
+
+# One classification axis: label names and their numeric codes, the gold
+# column it is scored against, its system prompt and few-shot examples.
+# `aliases` maps known misspellings to labels. `response_compression` is how
+# much of the engine response R the axis needs (see classifier/excerpts.py).
+class Axis:
+    def __init__(
+        self,
+        name,
+        gold_column,
+        labels,
+        system_prompt,
+        examples=None,
+        aliases=None,
+        response_compression="none",
+    ):
+        self.name = name
+        self.gold_column = gold_column
+        self.labels = labels
+        self.system_prompt = system_prompt
+        self.examples = examples or []
+        self.matcher = LabelMatcher(labels, system_prompt, aliases)
+        self.response_compression = response_compression
+
+    # The system prompt without its inline examples, for runs that send
+    # retrieved examples instead
+    @property
+    def instructions(self):
+        heading = INLINE_EXAMPLES_HEADING.search(self.system_prompt)
+        if heading is None:
+            return self.system_prompt
+        return self.system_prompt[: heading.end()] + "\n"
+
+    # Function to convert theme text to its numeric code ("0" if unknown).
+    # Prefixes, case, punctuation, prompt numbers and small typos are tolerated.
+    def theme_text_to_number(self, text):
+        label = self.matcher.match(text).label
+        return self.labels[label] if label else "0"
+
+
+# Function to load an axis definition from classifier/axes/<name>.json
+def load_axis(name):
+    with open(os.path.join(AXES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        definition = json.load(f)
+    with open(
+        os.path.join(AXES_DIR, definition["prompt_file"]), encoding="utf-8", newline=""
+    ) as f:
+        system_prompt = f.read()
+    return Axis(
+        name,
+        definition["gold_column"],
+        definition["labels"],
+        system_prompt,
+        definition.get("examples"),
+        definition.get("aliases"),
+        definition.get("response_compression", "none"),
+    )
+
+
+# Output column names for each axis. A single-axis run keeps the original
+# `classification` / `correct_classification` names.
+def classification_column(axis, axes):
+    return "classification" if len(axes) == 1 else f"{axis.name}_classification"
+
+
+def raw_column(axis, axes):
+    if len(axes) == 1:
+        return "raw_classification"
+    return f"{axis.name}_raw_classification"
+
+
+def confidence_column(axis, axes):
+    return "match_confidence" if len(axes) == 1 else f"{axis.name}_match_confidence"
+
+
+def probability_column(axis, axes):
+    if len(axes) == 1:
+        return "label_probability"
+    return f"{axis.name}_label_probability"
+
+
+def correct_column(axis, axes):
+    if len(axes) == 1:
+        return "correct_classification"
+    return f"{axis.name}_correct_classification"
+
+
+def agreement_column(axis, axes):
+    return "vote_agreement" if len(axes) == 1 else f"{axis.name}_vote_agreement"
+
+
+# The label_probability columns are only written when logprobs are requested,
+# the vote columns only in voting mode
+def output_fieldnames(axes, logprobs=False, voting=False):
+    fieldnames = ["row_id", "query", "response"]
+    if voting:
+        fieldnames += ["vote_samples", "votes"]
+    for axis in axes:
+        fieldnames += [
+            axis.gold_column,
+            raw_column(axis, axes),
+            classification_column(axis, axes),
+            confidence_column(axis, axes),
+        ]
+        if logprobs:
+            fieldnames.append(probability_column(axis, axes))
+        if voting:
+            fieldnames.append(agreement_column(axis, axes))
+        fieldnames.append(correct_column(axis, axes))
+    return fieldnames
+
+
+# Function to build a prompt from a CSV row, including the gold column of
+# every axis. The query is split into Q1/R/Q2 here, once per row.
+def prompt_from_row(row_id, row, axes):
+    prompt = {
+        "row_id": row_id,
+        "query": row["query"],
+        "excerpt": parse_excerpt(row["query"]),
+    }
+    for axis in axes:
+        prompt[axis.gold_column] = row[axis.gold_column]
+    return prompt
+
+
+# Function to stream prompts from the input file one row at a time. Parquet
+# and Arrow inputs are read for the query and gold columns only.
+def read_prompts(file_path, axes):
+    columns = ["query"] + [axis.gold_column for axis in axes]
+    for row_id, row in enumerate(read_rows(file_path, columns)):
+        yield prompt_from_row(str(row_id), row, axes)
+
+
+# Function to build the system prompt: the axis prompt itself for a single
+# axis, or every axis prompt under one JSON-answer instruction. Without inline
+# examples only each axis's instructions are kept.
+def build_system_prompt(axes, inline_examples=True):
+    prompts = [
+        axis.system_prompt if inline_examples else axis.instructions for axis in axes
+    ]
+    if len(axes) == 1:
+        return prompts[0]
+    example = json.dumps({axis.name: "..." for axis in axes})
+    sections = [COMBINED_INSTRUCTIONS.format(count=len(axes), example=example)]
+    for axis, prompt in zip(axes, prompts):
+        sections.append(f"Axis: {axis.name}\n{prompt.strip()}\n")
+    return "\n".join(sections)
+
+
+# Function to build the messages for one row. The system prompt (instructions
+# and inline examples) is byte-identical for every row and always comes first,
+# so the provider can serve it from its prompt prefix cache; only the
+# retrieved `examples` turns, if any, and the user message change per row.
+def build_messages(system_prompt, query, *follow_ups, examples=()):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *examples,
+        {"role": "user", "content": query},
+    ]
+    return messages + list(follow_ups)
+
+
+# Function to split a combined answer into one classification per axis.
+# Unparseable answers leave every axis empty, which scores as incorrect.
+def split_combined_response(response_text, axes):
+    try:
+        answers = json.loads(CODE_FENCE.sub("", response_text.strip()))
+    except json.JSONDecodeError:
+        answers = {}
+    if not isinstance(answers, dict):
+        answers = {}
+    return {axis.name: str(answers.get(axis.name, "")).strip() for axis in axes}
+
+
+# Function to get the raw answer for each axis from a response. A single-axis
+# answer is plain text, or a JSON object in schema mode.
+def raw_classifications(response_text, axes):
+    if len(axes) == 1:
+        if response_text.lstrip().startswith("{"):
+            answer = split_combined_response(response_text, axes)[axes[0].name]
+            if answer:
+                return {axes[0].name: answer}
+        return {axes[0].name: response_text}
+    return split_combined_response(response_text, axes)
+
+
+# Function to match each axis's answer to a label ({axis name: label or None})
+def matched_labels(response_text, axes):
+    answers = raw_classifications(response_text, axes)
+    return {axis.name: axis.matcher.match(answers[axis.name]).label for axis in axes}
+
+
+# Function to check whether any axis's answer fails to match a label
+def is_unparsed(response_text, axes):
+    if isinstance(response_text, RequestFailure):
+        return False
+    return None in matched_labels(response_text, axes).values()
+
+
+# Function to ask once more, listing the valid labels, for rows whose answer
+# did not match a label. Replaces the texts whose new answer does match and
+# adds the counts to the run totals of `metrics`.
+def requery_unparsed(
+    queries,
+    response_texts,
+    axes,
+    system_prompt,
+    engine,
+    cache,
+    examples=None,
+    row_tags=None,
+    metrics=None,
+):
+    unparsed = [i for i, text in enumerate(response_texts) if is_unparsed(text, axes)]
+    if not unparsed:
+        return response_texts
+    if len(axes) == 1:
+        instructions = REQUERY_INSTRUCTIONS.format(labels=", ".join(axes[0].labels))
+    else:
+        labels = json.dumps(
+            {axis.name: list(axis.labels) for axis in axes}, ensure_ascii=False
+        )
+        instructions = REQUERY_COMBINED_INSTRUCTIONS.format(labels=labels)
+    requeried = complete_with_cache(
+        engine,
+        [
+            build_messages(
+                system_prompt,
+                queries[i],
+                {"role": "assistant", "content": response_texts[i]},
+                {"role": "user", "content": instructions},
+                examples=examples[i] if examples else (),
+            )
+            for i in unparsed
+        ],
+        cache,
+        row_tags=[row_tags[i] for i in unparsed] if row_tags else None,
+    )
+    fixed = 0
+    for i, text in zip(unparsed, requeried):
+        if not isinstance(text, RequestFailure) and not is_unparsed(text, axes):
+            response_texts[i] = text
+            fixed += 1
+    if metrics is not None:
+        metrics.add_totals("requery", rows=len(unparsed), fixed=fixed)
+    return response_texts
+
+
+# Function to print the run totals requery_unparsed recorded (see RunMetrics)
+def report_requery(totals):
+    if totals["rows"]:
+        print(
+            f"Re-queried {totals['rows']} unparseable rows, "
+            f"{totals['fixed']} now match a label"
+        )
+
+
+# Function to compare an item's classification for `axis` with its gold label
+def is_correct_classification(item, axis, axes):
+    # Map textual classification back to its numeric value
+    classification_value = axis.theme_text_to_number(
+        item[classification_column(axis, axes)]
+    )
+    return item[axis.gold_column].strip() == classification_value
+
+
+# Function to build the request engine: one Batch API job for offline runs,
+# concurrent rate-limited calls otherwise
+def make_engine(
+    model_string,
+    api_key=None,
+    concurrency=8,
+    requests_per_minute=None,
+    tokens_per_minute=None,
+    max_attempts=6,
+    batch=False,
+    batch_input_path="batch_input.jsonl",
+    poll_interval=60,
+    **request_kwargs,
+):
+    if batch:
+        return BatchRunner(
+            model_string,
+            batch_path=batch_input_path,
+            poll_interval=poll_interval,
+            api_key=api_key,
+            **request_kwargs,
+        )
+    return AsyncClassificationEngine(
+        model_string,
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        api_key=api_key,
+        max_attempts=max_attempts,
+        **request_kwargs,
+    )
+
+
+# Function to label the rows every axis's fast path is confident about.
+# Returns one {axis name: label} dict per prompt, or None where the LLM is needed.
+def fast_path_labels(prompts, axes, fast_paths):
+    queries = [prompt["query"] for prompt in prompts]
+    predictions = {axis.name: fast_paths[axis.name].predict(queries) for axis in axes}
+    labels = []
+    for i, prompt in enumerate(prompts):
+        if not all(predictions[axis.name][i] for axis in axes):
+            labels.append(None)
+            continue
+        labels.append({axis.name: predictions[axis.name][i][0] for axis in axes})
+        for axis in axes:
+            fast_path = fast_paths[axis.name]
+            fast_path.assigned += 1
+            label_value = axis.theme_text_to_number(labels[-1][axis.name])
+            fast_path.correct += prompt[axis.gold_column].strip() == label_value
+    for axis in axes:
+        fast_paths[axis.name].checked += len(prompts)
+    return labels
+
+
+# Classify a list of prompts along the given axes with one request per row
+# (or per pack of rows). Rows the local fast path is confident about skip the
+# API. Returns the prompts_responses items in input order.
+def generate_responses(
+    prompts,
+    axes,
+    engine,
+    cache=None,
+    pack_size=1,
+    fast_paths=None,
+    requery=False,
+    output_mode="text",
+    logprobs=False,
+    voter=None,
+    compressor=None,
+    few_shot=None,
+    metrics=None,
+):
+    fast_labels = [None] * len(prompts)
+    if fast_paths:
+        fast_labels = fast_path_labels(prompts, axes, fast_paths)
+    llm_prompts = [
+        prompt for prompt, labels in zip(prompts, fast_labels) if labels is None
+    ]
+    # The user message for each row, with R compressed if so configured
+    queries = [
+        compressor.request_text(prompt) if compressor else prompt["query"]
+        for prompt in llm_prompts
+    ]
+
+    system_prompt = output_mode_system_prompt(
+        build_system_prompt(axes, inline_examples=few_shot is None), axes, output_mode
+    )
+    # Retrieved examples go between the static system prompt and the row
+    examples = [()] * len(llm_prompts)
+    if few_shot is not None:
+        examples = few_shot.example_messages(llm_prompts, compressor)
+    message_lists = [
+        build_messages(system_prompt, query, examples=row_examples)
+        for query, row_examples in zip(queries, examples)
+    ]
+    row_tags = [ResponseCache.row_tag(prompt["query"]) for prompt in llm_prompts]
+    if pack_size > 1:
+        # Classify pack_size rows per request to share the system prompt
+        llm_texts = complete_packed(
+            engine,
+            system_prompt,
+            queries,
+            pack_size,
+            cache,
+            row_tags,
+            metrics,
+        )
+    elif voter is not None:
+        llm_texts = voter.complete(
+            engine,
+            message_lists,
+            axes,
+            lambda text: matched_labels(text, axes),
+            cache,
+            row_tags,
+        )
+    else:
+        llm_texts = complete_with_cache(engine, message_lists, cache, row_tags=row_tags)
+    if requery:
+        llm_texts = requery_unparsed(
+            queries,
+            llm_texts,
+            axes,
+            system_prompt,
+            engine,
+            cache,
+            examples,
+            row_tags,
+            metrics,
+        )
+    llm_texts = iter(llm_texts)
+    # Matching answers to labels is timed apart from the requests
+    with (metrics or RunMetrics()).stage("parse"):
+        return parse_responses(prompts, fast_labels, llm_texts, axes, logprobs)
+
+
+# Function to turn the answers into prompts_responses items: match each answer
+# to a label per axis and keep the raw answer, confidence, answer probability
+# and vote agreement next to it
+def parse_responses(prompts, fast_labels, llm_texts, axes, logprobs=False):
+    prompts_responses = []
+    for prompt, labels in zip(prompts, fast_labels):
+        if labels is not None:
+            response_text = "fast path: " + json.dumps(labels, ensure_ascii=False)
+        else:
+            response_text = next(llm_texts)
+        item = {
+            "row_id": prompt["row_id"],
+            "query": prompt["query"],
+            "response": response_text,
+        }
+        if isinstance(response_text, RequestFailure):
+            # Logged as a failure by the pipeline and retried on --resume
+            item["error"] = str(response_text)
+            prompts_responses.append(item)
+            continue
+
+        if labels is not None:
+            classifications = labels
+        else:
+            classifications = raw_classifications(response_text, axes)
+        probabilities = answer_probabilities(response_text, axes)
+        votes = getattr(response_text, "votes", None)
+        if votes is not None:
+            item["vote_samples"] = response_text.samples
+            item["votes"] = json.dumps(votes, ensure_ascii=False)
+        for axis in axes:
+            if votes is not None and votes[axis.name]:
+                top_votes = max(votes[axis.name].values())
+                item[agreement_column(axis, axes)] = (
+                    f"{top_votes / response_text.samples:.2f}"
+                )
+            if logprobs and axis.name in probabilities:
+                item[probability_column(axis, axes)] = (
+                    f"{probabilities[axis.name]:.4f}"
+                )
+            # Keep the raw answer next to the label it was matched to
+            match = axis.matcher.match(classifications[axis.name])
+            item[axis.gold_column] = prompt[axis.gold_column]
+            item[raw_column(axis, axes)] = classifications[axis.name]
+            item[classification_column(axis, axes)] = match.label or ""
+            item[confidence_column(axis, axes)] = f"{match.confidence:.2f}"
+        prompts_responses.append(item)
+    return prompts_responses
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="max in-flight API requests"
+    )
+    parser.add_argument("--rpm", type=int, help="requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, help="tokens-per-minute budget")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="bypass the response cache"
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="submit all rows as one Batch API job"
+    )
+    parser.add_argument(
+        "--poll-interval", type=int, default=60, help="batch status poll seconds"
+    )
+    parser.add_argument(
+        "--pack", type=int, default=1, help="classify N rows per API call"
+    )
+    parser.add_argument(
+        "--max-attempts", type=int, default=6, help="attempts per request"
+    )
+    parser.add_argument(
+        "--fast-path",
+        metavar="LABELLED_CSV",
+        help="label rows close to these labelled rows locally, without an API call",
+    )
+    parser.add_argument(
+        "--fast-path-threshold",
+        type=float,
+        default=0.85,
+        help="minimum n-gram cosine similarity for a fast-path label",
+    )
+    parser.add_argument(
+        "--fast-path-margin",
+        type=float,
+        default=0.1,
+        help="minimum similarity lead over the closest other label",
+    )
+    parser.add_argument(
+        "--few-shot",
+        metavar="LABELLED_CSV",
+        help="send each row with the most similar labelled rows as examples, "
+        "instead of every example inlined in the system prompt",
+    )
+    parser.add_argument(
+        "--few-shot-k", type=int, default=6, help="retrieved examples per row"
+    )
+    parser.add_argument(
+        "--few-shot-per-label",
+        type=int,
+        default=2,
+        help="at most this many retrieved examples with the same label",
+    )
+    parser.add_argument(
+        "--output-mode",
+        choices=OUTPUT_MODES,
+        default="text",
+        help="free text, a function call limited to the labels, or the label number",
+    )
+    parser.add_argument(
+        "--logprobs",
+        action="store_true",
+        help="record the model's probability for each answer",
+    )
+    parser.add_argument(
+        "--vote",
+        type=int,
+        default=1,
+        help="sample each row up to N times and take the majority label",
+    )
+    parser.add_argument(
+        "--vote-min-agree",
+        type=int,
+        default=0,
+        help="shortcut, off by default: also stop once the first K samples agree",
+    )
+    parser.add_argument(
+        "--vote-temperature",
+        type=float,
+        default=0.7,
+        help="sampling temperature in voting mode",
+    )
+    parser.add_argument(
+        "--requery-unparsed",
+        action="store_true",
+        help="ask once more, listing the labels, when an answer matches no label",
+    )
+    parser.add_argument(
+        "--compress-response",
+        metavar="SETTING",
+        help="shorten R before sending, e.g. sentences:150 or axis1=none,axis2=drop",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=200, help="rows per checkpointed chunk"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="skip rows already in the checkpoint"
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="classify in N worker processes, sharing the rate limits between them",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="print progress at most this often",
+    )
+    parser.add_argument(
+        "--event-log",
+        help="JSON-lines event log (default: <output>.events.jsonl)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on this local port (shard i uses port + i)",
+    )
+    return parser
+
+
+# Function to read each axis's R compression setting: its definition's
+# "response_compression", overridden by --compress-response, which is either
+# one setting for every axis or comma-separated axis=setting pairs
+def compression_settings(axes, option=None):
+    settings = {axis.name: axis.response_compression for axis in axes}
+    for part in filter(None, (option or "").split(",")):
+        name, _, setting = part.rpartition("=")
+        if not name:
+            settings = dict.fromkeys(settings, setting)
+        elif name in settings:
+            settings[name] = setting
+        else:
+            raise ValueError(f"--compress-response names unknown axis {name!r}")
+    return settings
+
+
+def score_columns(axes):
+    return [correct_column(axis, axes) for axis in axes]
+
+
+# Classify a stream of prompts in this process and write them to
+# `output_csv_path`. A shard worker (`shard_index` set) gets its share of the
+# concurrency and rate limits. `total_rows` is only used for progress and ETA.
+# Returns the accuracies and the usage tracker.
+def classify_prompts(
+    prompts,
+    axes,
+    input_csv_path,
+    output_csv_path,
+    model_string,
+    api_key,
+    args,
+    shard_index=None,
+    total_rows=None,
+):
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(
+            cache_path,
+            max_entries=cache_max_entries,
+            max_age_days=cache_max_age_days,
+        )
+    fast_paths = None
+    if args.fast_path:
+        # numpy and scipy are only needed for the fast path, so import them on demand
+        from classifier.fast_path import build_fast_path
+
+        fast_paths = {
+            axis.name: build_fast_path(
+                axis,
+                args.fast_path,
+                threshold=args.fast_path_threshold,
+                margin=args.fast_path_margin,
+            )
+            for axis in axes
+        }
+    few_shot = None
+    if args.few_shot:
+        # numpy and scipy are only needed for retrieval, so import them on demand
+        from classifier.few_shot import build_few_shot
+
+        few_shot = build_few_shot(
+            axes,
+            args.few_shot,
+            output_mode=args.output_mode,
+            k=args.few_shot_k,
+            per_label=args.few_shot_per_label,
+        )
+    axis_names = "_".join(axis.name for axis in axes)
+    batch_input_path = f"batch_input_{axis_names}.jsonl"
+    shard_count = 1
+    if shard_index is not None:
+        batch_input_path = shard_output_path(batch_input_path, shard_index)
+        shard_count = args.shards
+    request_kwargs = output_mode_request_kwargs(axes, args.output_mode, args.logprobs)
+    voter = None
+    if args.vote > 1:
+        # Samples must differ to be worth voting over
+        request_kwargs["temperature"] = args.vote_temperature
+        voter = SelfConsistencyVoter(args.vote, args.vote_min_agree)
+    # A combined request keeps as much of R as its most demanding axis needs
+    compressor = widest_compressor(
+        compression_settings(axes, args.compress_response).values()
+    )
+    engine = make_engine(
+        model_string,
+        api_key=api_key,
+        concurrency=-(-args.concurrency // shard_count),
+        requests_per_minute=args.rpm / shard_count if args.rpm else None,
+        tokens_per_minute=args.tpm / shard_count if args.tpm else None,
+        max_attempts=args.max_attempts,
+        batch=args.batch,
+        batch_input_path=batch_input_path,
+        poll_interval=args.poll_interval,
+        **request_kwargs,
+    )
+    event_log_path = args.event_log or f"{output_csv_path}.events.jsonl"
+    if args.event_log and shard_index is not None:
+        event_log_path = shard_output_path(args.event_log, shard_index)
+    metrics = RunMetrics(
+        engine,
+        total_rows=total_rows,
+        label_columns={
+            correct_column(axis, axes): (
+                axis.gold_column,
+                {code: label for label, code in axis.labels.items()},
+            )
+            for axis in axes
+        },
+        progress_interval=args.progress_interval,
+        event_log_path=event_log_path,
+        metrics_port=args.metrics_port and args.metrics_port + (shard_index or 0),
+        name="" if shard_index is None else f"shard {shard_index}",
+        resume=args.resume,
+    )
+
+    # Rows stream through in chunks; each finished chunk is appended to the
+    # output and checkpointed. A batch chunk holds up to one batch's worth of
+    # requests; BatchRunner splits it into several jobs if its input file
+    # would exceed the API's size limit.
+    accuracies = run_pipeline(
+        prompts,
+        lambda chunk: generate_responses(
+            chunk,
+            axes,
+            engine,
+            cache=cache,
+            pack_size=args.pack,
+            fast_paths=fast_paths,
+            requery=args.requery_unparsed,
+            output_mode=args.output_mode,
+            logprobs=args.logprobs,
+            voter=voter,
+            compressor=compressor,
+            few_shot=few_shot,
+            metrics=metrics,
+        ),
+        {
+            correct_column(axis, axes): (
+                lambda item, axis=axis: is_correct_classification(item, axis, axes)
+            )
+            for axis in axes
+        },
+        output_csv_path,
+        output_fieldnames(axes, args.logprobs, voter is not None),
+        f"{output_csv_path}.checkpoint",
+        f"{output_csv_path}.failures.jsonl",
+        resume=args.resume,
+        chunk_size=MAX_BATCH_REQUESTS if args.batch else args.chunk_size,
+        metrics=metrics,
+    )
+    report_packing(metrics.totals["packing"])
+    report_requery(metrics.totals["requery"])
+    if fast_paths:
+        for axis in axes:
+            fast_paths[axis.name].report(axis.name)
+    if voter is not None:
+        voter.report()
+    compressor.report()
+    if few_shot is not None:
+        few_shot.report()
+    if cache is not None:
+        cache.report()
+        cache.close()
+    return accuracies, engine.usage
+
+
+# Worker process entry point for sharded runs: classify one shard of the
+# input into its own output, checkpoint and failures files
+def classify_shard(
+    shard_index,
+    shard,
+    axes,
+    input_csv_path,
+    output_csv_path,
+    model_string,
+    api_key,
+    args,
+):
+    prompts = (
+        prompt_from_row(row_id, row, axes)
+        for row_id, row in read_csv_shard(input_csv_path, *shard)
+    )
+    return classify_prompts(
+        prompts,
+        axes,
+        input_csv_path,
+        shard_output_path(output_csv_path, shard_index),
+        model_string,
+        api_key,
+        args,
+        shard_index=shard_index,
+        total_rows=shard[2],
+    )
+
+
+# Function to reject option combinations that cannot work together
+def check_args(parser, args, axes):
+    if args.pack > 1 and args.output_mode != "text":
+        parser.error("--pack only works with --output-mode text")
+    if args.pack > 1 and args.vote > 1:
+        parser.error("--pack and --vote cannot be combined")
+    if args.logprobs and args.output_mode == "schema":
+        parser.error("--logprobs does not cover the function call of schema mode")
+    if args.pack > 1 and args.few_shot:
+        parser.error("--pack and --few-shot cannot be combined")
+    try:
+        widest_compressor(compression_settings(axes, args.compress_response).values())
+    except ValueError as error:
+        parser.error(str(error))
+
+
+# Entry point shared by the classifier scripts: stream the input CSV through
+# the chosen engine and append results to the output CSV. With --shards N the
+# input is split into N byte ranges classified in parallel worker processes,
+# and their outputs are merged back into input order.
+def main(axes, input_csv_path, output_csv_path, model_string, api_key=None):
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    check_args(parser, args, axes)
+    columnar = is_columnar(input_csv_path) or is_columnar(output_csv_path)
+    if args.shards > 1 and columnar:
+        parser.error("--shards needs a CSV input and output")
+
+    if args.shards > 1:
+        results = run_sharded(
+            input_csv_path,
+            output_csv_path,
+            args.shards,
+            score_columns(axes),
+            classify_shard,
+            axes,
+            input_csv_path,
+            output_csv_path,
+            model_string,
+            api_key,
+            args,
+        )
+        usage = results[0][1]
+        for _, shard_usage in results[1:]:
+            usage.extend(shard_usage)
+    else:
+        _, usage = classify_prompts(
+            read_prompts(input_csv_path, axes),
+            axes,
+            input_csv_path,
+            output_csv_path,
+            model_string,
+            api_key,
+            args,
+            total_rows=count_rows(input_csv_path),
+        )
+    usage.report()
+    print("Completed. Responses and accuracy have been saved to", output_csv_path)
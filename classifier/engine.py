@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import random
+import time
+
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+
+from classifier.usage import UsageTracker
+
+# Status codes worth retrying besides 5xx: request timeout, conflict, rate limit
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+# Rough token estimate used for rate-limit budgeting. English text averages
+# about four characters per token, Hangul is closer to one token per character.
+def estimate_tokens(text):
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+# Estimate the prompt tokens of a chat message list, including per-message overhead
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+
+# Token bucket that refills continuously up to `per_minute` units per minute.
+# Callers take tokens up front and sleep off any debt, so waiters are served in
+# arrival order and the bucket can be shared across event loops.
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    async def acquire(self, amount=1):
+        # A single request larger than the whole budget waits for a full bucket
+        amount = min(amount, self.capacity)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+# Returned in place of a response when a request fails for good, so the row is
+# recorded as a failure instead of aborting the whole run
+class RequestFailure:
+    def __init__(self, error, attempts):
+        self.error = error
+        self.attempts = attempts
+
+    def __str__(self):
+        error_type = type(self.error).__name__
+        return f"{error_type} after {self.attempts} attempt(s): {self.error}"
+
+
+def is_retryable(error):
+    # APIConnectionError also covers request timeouts
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        status = error.status_code
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    return False
+
+
+# Seconds the server asked us to wait, from the retry-after(-ms) headers
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+    except ValueError:
+        # The HTTP-date form of Retry-After is not used by the OpenAI API
+        return None
+    return None
+
+
+# Opens after `threshold` consecutive retryable failures. While open, requests
+# wait out the cooldown instead of hammering an API that is down or throttling;
+# every further failure re-opens it, the first success closes it.
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.threshold:
+            if time.monotonic() >= self.open_until:
+                print(
+                    f"Circuit breaker open after {self.consecutive_failures} "
+                    f"consecutive failures, pausing {self.cooldown:g}s"
+                )
+            self.open_until = time.monotonic() + self.cooldown
+
+    async def wait_until_closed(self):
+        delay = self.open_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Sends chat completion requests concurrently with AsyncOpenAI, bounded by a
+# concurrency limit and optional per-minute request and token budgets.
+# Retryable errors (429, 5xx, timeouts) are retried with exponential backoff
+# and full jitter, honouring Retry-After; requests that still fail come back
+# as RequestFailure. Results are always returned in input order.
+class AsyncClassificationEngine:
+    def __init__(
+        self,
+        model,
+        concurrency=8,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        api_key=None,
+        base_url=None,
+        client=None,
+        max_attempts=6,
+        base_backoff=1.0,
+        max_backoff=60.0,
+        breaker_threshold=5,
+        breaker_cooldown=30.0,
+        timeout=120.0,
+        **request_kwargs,
+    ):
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        # Buckets live on the engine so budgets carry over between run() calls
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        # Falls back to OPENAI_BASE_URL, so a local mock server can be used
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.client = client
+        self.max_attempts = max(1, max_attempts)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.timeout = timeout
+        self.request_kwargs = request_kwargs
+        self.retries = 0
+        self.failures = 0
+        # Requests sent and not yet answered, for live metrics
+        self.in_flight = 0
+        self.usage = UsageTracker(model)
+
+    def _make_client(self):
+        # Retries are handled here, not by the SDK, so pacing stays in one place
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            max_retries=0,
+            timeout=self.timeout,
+        )
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(
+            0, min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+        )
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def _complete(self, client, messages, semaphore):
+        async with semaphore:
+            for attempt in range(1, self.max_attempts + 1):
+                await self.breaker.wait_until_closed()
+                if self.request_bucket:
+                    await self.request_bucket.acquire(1)
+                if self.token_bucket:
+                    await self.token_bucket.acquire(estimate_message_tokens(messages))
+                started = time.monotonic()
+                self.in_flight += 1
+                try:
+                    response = await client.chat.completions.create(
+                        model=self.model, messages=messages, **self.request_kwargs
+                    )
+                except (APIConnectionError, APIStatusError) as error:
+                    self.in_flight -= 1
+                    if not is_retryable(error):
+                        self.failures += 1
+                        return RequestFailure(error, attempt)
+                    self.breaker.record_failure()
+                    if attempt == self.max_attempts:
+                        self.failures += 1
+                        return RequestFailure(error, attempt)
+                    self.retries += 1
+                    await asyncio.sleep(self._backoff(attempt, error))
+                else:
+                    self.in_flight -= 1
+                    self.breaker.record_success()
+                    self.usage.record(response, time.monotonic() - started)
+                    return response
+
+    async def complete_all(self, message_lists):
+        # The semaphore is created here so it binds to the running loop
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client = self.client or self._make_client()
+        try:
+            return await asyncio.gather(
+                *(
+                    self._complete(client, messages, semaphore)
+                    for messages in message_lists
+                )
+            )
+        finally:
+            if self.client is None:
+                await client.close()
+
+    # Blocking entry point for the synchronous classifier scripts
+    def run(self, message_lists):
+        return asyncio.run(self.complete_all(message_lists))
+
+
+# Response text that also carries the (token, logprob) pairs of the answer,
+# when the request asked for logprobs
+class ScoredText(str):
+    def __new__(cls, text, token_logprobs):
+        scored = super().__new__(cls, text)
+        scored.token_logprobs = token_logprobs
+        return scored
+
+
+# Extract the stripped text of the first choice, as the classifiers expect.
+# A RequestFailure is passed through unchanged so callers can record it per row.
+# A forced function call (schema mode) gives the call's JSON arguments. A
+# choice with neither (a refusal) becomes a RequestFailure carrying the refusal.
+def extract_response_text(response):
+    if isinstance(response, RequestFailure):
+        return response
+    if response.choices:
+        choice = response.choices[0]
+        if choice.message.content is None and choice.message.tool_calls:
+            return choice.message.tool_calls[0].function.arguments.strip()
+        if choice.message.content is None:
+            refusal = getattr(choice.message, "refusal", None)
+            reason = f"refused: {refusal}" if refusal else "empty message content"
+            return RequestFailure(RuntimeError(reason), 1)
+        text = choice.message.content.strip()
+        if choice.logprobs and choice.logprobs.content:
+            tokens = [(token.token, token.logprob) for token in choice.logprobs.content]
+            return ScoredText(text, tokens)
+        return text
+    return "No response"
+
+
+# Sum the billed tokens reported in the usage of the given responses
+def total_tokens(responses):
+    return sum(
+        response.usage.total_tokens
+        for response in responses
+        if not isinstance(response, RequestFailure) and response.usage
+    )
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Columnar evaluation of classifier output files: confusion matrix, per-label
+# precision/recall/F1 and Cohen's kappa against the gold column, and
+# run-to-run differences, written as a JSON and a Markdown report.
+#
+#   python -m classifier.evaluation axis1 model_responses_gpt4.csv other_run.csv
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from classifier.core import load_axis
+from classifier.pipeline import column_names, is_columnar
+
+# Code used for responses that do not map to any label
+UNPARSED_CODE = "0"
+
+
+# Function to load one result file into columnar arrays: row_id, gold code and
+# predicted code. Works for single-axis and combined output files, in CSV or
+# any columnar format the classifier writes.
+def load_results(path, axis):
+    columns = column_names(path)
+    classification = f"{axis.name}_classification"
+    if classification not in columns:
+        classification = "classification"
+    usecols = ["row_id", axis.gold_column, classification]
+    if is_columnar(path):
+        from classifier.columnar import read_columnar_table
+
+        # Arrow string columns become pandas columns without a CSV parse
+        frame = read_columnar_table(path, usecols).to_pandas().fillna("")
+    else:
+        frame = pd.read_csv(path, usecols=usecols, dtype=str, keep_default_na=False)
+    # A resumed run re-appends rows written after the last checkpoint; the
+    # later copy is the one the checkpoint records
+    frame = frame.drop_duplicates("row_id", keep="last")
+    # Label matching runs once per distinct answer, not once per row
+    answers = frame[classification]
+    codes = {answer: axis.theme_text_to_number(answer) for answer in answers.unique()}
+    return pd.DataFrame(
+        {
+            "row_id": frame["row_id"],
+            "gold": frame[axis.gold_column].str.strip(),
+            "predicted": answers.map(codes),
+        }
+    )
+
+
+# Label codes in numeric order, with the unparsed code last
+def label_codes(axis):
+    return sorted(axis.labels.values(), key=int) + [UNPARSED_CODE]
+
+
+def confusion_matrix(gold, predicted, codes):
+    index = {code: i for i, code in enumerate(codes)}
+    size = len(codes)
+    # Gold codes outside the label set are counted as unparsed
+    gold_index = gold.map(index).fillna(index[UNPARSED_CODE]).to_numpy(dtype=np.int64)
+    predicted_index = predicted.map(index).to_numpy(dtype=np.int64)
+    counts = np.bincount(gold_index * size + predicted_index, minlength=size * size)
+    return counts.reshape(size, size)
+
+
+# Per-label precision, recall and F1, accuracy, macro F1 and Cohen's kappa
+# from a confusion matrix with gold labels as rows
+def scores(matrix):
+    total = matrix.sum()
+    true_positives = np.diag(matrix).astype(np.float64)
+    predicted_totals = matrix.sum(axis=0)
+    gold_totals = matrix.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted_totals, true_positives / predicted_totals, 0.0)
+        recall = np.where(gold_totals, true_positives / gold_totals, 0.0)
+        f1 = np.where(
+            precision + recall, 2 * precision * recall / (precision + recall), 0.0
+        )
+    observed = true_positives.sum() / total if total else 0.0
+    expected = (predicted_totals * gold_totals).sum() / total**2 if total else 0.0
+    kappa = (observed - expected) / (1 - expected) if expected < 1 else 0.0
+    present = gold_totals > 0
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "support": gold_totals,
+        "accuracy": float(observed),
+        "macro_f1": float(f1[present].mean()) if present.any() else 0.0,
+        "kappa": float(kappa),
+    }
+
+
+def evaluate_run(results, axis):
+    codes = label_codes(axis)
+    names = {code: label for label, code in axis.labels.items()}
+    names[UNPARSED_CODE] = "Unparsed"
+    matrix = confusion_matrix(results["gold"], results["predicted"], codes)
+    run_scores = scores(matrix)
+    return {
+        "rows": int(len(results)),
+        "accuracy": run_scores["accuracy"],
+        "macro_f1": run_scores["macro_f1"],
+        "cohen_kappa": run_scores["kappa"],
+        "labels": [
+            {
+                "code": code,
+                "label": names[code],
+                "precision": float(run_scores["precision"][i]),
+                "recall": float(run_scores["recall"][i]),
+                "f1": float(run_scores["f1"][i]),
+                "support": int(run_scores["support"][i]),
+            }
+            for i, code in enumerate(codes)
+        ],
+        "confusion_matrix": {"codes": codes, "counts": matrix.tolist()},
+    }
+
+
+# Compare two runs on the rows they share: how often the predicted code
+# changed, how many rows became correct or incorrect, and Cohen's kappa
+# between the two runs
+def diff_runs(base, other, axis):
+    merged = base.merge(other, on="row_id", suffixes=("_base", "_other"))
+    base_correct = merged["predicted_base"] == merged["gold_base"]
+    other_correct = merged["predicted_other"] == merged["gold_base"]
+    changed = merged["predicted_base"] != merged["predicted_other"]
+    agreement = scores(
+        confusion_matrix(
+            merged["predicted_base"], merged["predicted_other"], label_codes(axis)
+        )
+    )
+    return {
+        "shared_rows": int(len(merged)),
+        "changed": int(changed.sum()),
+        "agreement": float(1 - changed.mean()) if len(merged) else 0.0,
+        "kappa_between_runs": agreement["kappa"],
+        "became_correct": int((~base_correct & other_correct).sum()),
+        "became_incorrect": int((base_correct & ~other_correct).sum()),
+    }
+
+
+def build_report(paths, axis):
+    runs = {path: load_results(path, axis) for path in paths}
+    report = {
+        "axis": axis.name,
+        "runs": {path: evaluate_run(results, axis) for path, results in runs.items()},
+        "diffs": [],
+    }
+    base_path = paths[0]
+    for path in paths[1:]:
+        diff = diff_runs(runs[base_path], runs[path], axis)
+        report["diffs"].append({"base": base_path, "other": path, **diff})
+    return report
+
+
+def format_markdown(report):
+    lines = [f"# Evaluation report: {report['axis']}", ""]
+    for path, run in report["runs"].items():
+        lines += [
+            f"## {path}",
+            "",
+            f"- Rows: {run['rows']}",
+            f"- Accuracy: {run['accuracy']:.2%}",
+            f"- Macro F1: {run['macro_f1']:.3f}",
+            f"- Cohen's kappa: {run['cohen_kappa']:.3f}",
+            "",
+            "| Code | Label | Precision | Recall | F1 | Support |",
+            "| --- | --- | --- | --- | --- | --- |",
+        ]
+        for label in run["labels"]:
+            lines.append(
+                f"| {label['code']} | {label['label']} | {label['precision']:.3f} "
+                f"| {label['recall']:.3f} | {label['f1']:.3f} | {label['support']} |"
+            )
+        codes = run["confusion_matrix"]["codes"]
+        lines += [
+            "",
+            "Confusion matrix (rows: gold, columns: predicted)",
+            "",
+            "| gold \\ predicted | " + " | ".join(codes) + " |",
+            "| --- " * (len(codes) + 1) + "|",
+        ]
+        for code, counts in zip(codes, run["confusion_matrix"]["counts"]):
+            lines.append(f"| {code} | " + " | ".join(map(str, counts)) + " |")
+        lines.append("")
+    if report["diffs"]:
+        lines += [
+            "## Run-to-run differences",
+            "",
+            "| Base | Other | Shared rows | Changed | Agreement | Kappa "
+            "| Became correct | Became incorrect |",
+            "| --- | --- | --- | --- | --- | --- | --- | --- |",
+        ]
+        for diff in report["diffs"]:
+            lines.append(
+                f"| {diff['base']} | {diff['other']} | {diff['shared_rows']} "
+                f"| {diff['changed']} | {diff['agreement']:.2%} "
+                f"| {diff['kappa_between_runs']:.3f} | {diff['became_correct']} "
+                f"| {diff['became_incorrect']} |"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+
+def write_report(report, json_path, markdown_path):
+    with open(json_path, mode="w", encoding="utf-8") as json_file:
+        json.dump(report, json_file, ensure_ascii=False, indent=2)
+    with open(markdown_path, mode="w", encoding="utf-8") as markdown_file:
+        markdown_file.write(format_markdown(report))
+    print(f"Evaluation report saved to {json_path} and {markdown_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate classifier output files")
+    parser.add_argument("axis", help="axis name, e.g. axis1")
+    parser.add_argument(
+        "results",
+        nargs="+",
+        help="output files (CSV, Parquet, Arrow); later runs are diffed with the first",
+    )
+    parser.add_argument("--json", help="JSON report path")
+    parser.add_argument("--markdown", help="Markdown report path")
+    args = parser.parse_args()
+
+    stem = os.path.splitext(args.results[0])[0]
+    write_report(
+        build_report(args.results, load_axis(args.axis)),
+        args.json or f"{stem}.{args.axis}.report.json",
+        args.markdown or f"{stem}.{args.axis}.report.md",
+    )
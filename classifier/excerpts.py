@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import collections
+import math
+import re
+
+from classifier.engine import estimate_tokens
+
+# A log excerpt split into the initial query, the engine's response and the
+# follow-up query
+Excerpt = collections.namedtuple("Excerpt", ["q1", "response", "q2"])
+
+# "Q1:", "R:" and "Q2:" markers, with any case, spacing or a full-width colon,
+# at the start of the text or after whitespace or a comma
+MARKERS = {
+    name: re.compile(r"(?:^|(?<=[\s,]))" + name + r"\s*[:：]\s*", re.IGNORECASE)
+    for name in ("Q1", "R", "Q2")
+}
+SEPARATORS = " \t\r\n,"
+
+# Sentence ends in an engine response: terminal punctuation or a line break
+SENTENCE_END = re.compile(r"(?<=[.!?。])\s+|\s*\n+\s*")
+
+# Strategies for shortening R, in the form "strategy" or "strategy:budget"
+# with the budget in estimated tokens:
+#   none       send the query as it is
+#   head       keep the start of R
+#   head-tail  keep the start and the end of R
+#   sentences  keep the sentences of R sharing the most with Q1 and Q2
+#   drop       leave R out
+COMPRESSION_STRATEGIES = ("none", "head", "head-tail", "sentences", "drop")
+DEFAULT_BUDGET = 200
+ELLIPSIS = " … "
+
+
+# Function to split a query into Q1, R and Q2. Text before R counts as Q1
+# even without a "Q1:" marker. Returns None unless R and Q2 are both marked,
+# in which case the query is sent unchanged.
+def parse_excerpt(text):
+    q1_marker = MARKERS["Q1"].search(text)
+    r_marker = MARKERS["R"].search(text, q1_marker.end() if q1_marker else 0)
+    if r_marker is None:
+        return None
+    q2_marker = MARKERS["Q2"].search(text, r_marker.end())
+    if q2_marker is None:
+        return None
+    q1_start = q1_marker.end() if q1_marker else 0
+    return Excerpt(
+        text[q1_start : r_marker.start()].strip(SEPARATORS),
+        text[r_marker.end() : q2_marker.start()].strip(SEPARATORS),
+        text[q2_marker.end() :].strip(SEPARATORS),
+    )
+
+
+# Function to write an excerpt back in the "Q1: / R: / Q2:" layout of the axis
+# prompts. A response of None leaves the R line out.
+def format_excerpt(excerpt, response):
+    lines = [f"Q1: {excerpt.q1}"]
+    if response is not None:
+        lines.append(f"R: {response}")
+    lines.append(f"Q2: {excerpt.q2}")
+    return "\n".join(lines)
+
+
+# Function to cut text to the longest prefix (or suffix) that fits `budget`
+# tokens as counted by estimate_tokens
+def truncate_to_tokens(text, budget, from_end=False):
+    if from_end:
+        return truncate_to_tokens(text[::-1], budget)[::-1]
+    cost = 0.0
+    for i, ch in enumerate(text):
+        cost += 0.25 if ord(ch) < 128 else 1
+        if cost > budget:
+            return text[:i]
+    return text
+
+
+def character_bigrams(text):
+    text = "".join(text.casefold().split())
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+# Shortens the R part of each row before it is sent, counting the estimated
+# tokens of R before and after for the run report
+class ResponseCompressor:
+    def __init__(self, strategy="none", budget=DEFAULT_BUDGET):
+        self.strategy = strategy
+        self.budget = budget
+        self.rows = 0
+        self.original_tokens = 0
+        self.kept_tokens = 0
+
+    @property
+    def setting(self):
+        if self.strategy in ("none", "drop"):
+            return self.strategy
+        return f"{self.strategy}:{self.budget}"
+
+    # Estimated R tokens this setting can keep, for picking the setting of a
+    # request shared by several axes
+    @property
+    def capacity(self):
+        if self.strategy == "none":
+            return math.inf
+        return 0 if self.strategy == "drop" else self.budget
+
+    def compress(self, excerpt):
+        response = excerpt.response
+        if self.strategy == "drop":
+            return None
+        if estimate_tokens(response) <= self.budget:
+            return response
+        if self.strategy == "head":
+            return truncate_to_tokens(response, self.budget).rstrip() + " …"
+        if self.strategy == "head-tail":
+            head = truncate_to_tokens(response, self.budget / 2).rstrip()
+            tail = truncate_to_tokens(response, self.budget / 2, from_end=True)
+            return head + ELLIPSIS + tail.lstrip()
+        return self._best_sentences(excerpt)
+
+    # Keep the sentences whose character bigrams overlap most with Q1 and Q2,
+    # in their original order. The first sentence usually answers Q1 directly,
+    # so it ranks first on ties.
+    def _best_sentences(self, excerpt):
+        sentences = [s for s in SENTENCE_END.split(excerpt.response) if s]
+        query_bigrams = character_bigrams(excerpt.q1 + excerpt.q2)
+        scores = []
+        for i, sentence in enumerate(sentences):
+            bigrams = character_bigrams(sentence)
+            overlap = len(bigrams & query_bigrams) / math.sqrt(len(bigrams) or 1)
+            scores.append(overlap + (0.5 if i == 0 else 0))
+        kept = set()
+        remaining = self.budget
+        for i in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+            cost = estimate_tokens(sentences[i])
+            if cost <= remaining:
+                kept.add(i)
+                remaining -= cost
+        if not kept:
+            return truncate_to_tokens(sentences[0], self.budget).rstrip() + " …"
+        parts = []
+        for i in sorted(kept):
+            if parts and i - 1 not in kept:
+                parts.append("…")
+            parts.append(sentences[i])
+        if max(kept) < len(sentences) - 1:
+            parts.append("…")
+        return " ".join(parts)
+
+    # Function to compress a query that is not a row of the run, such as a
+    # few-shot example, without counting it in the report
+    def shorten(self, query):
+        excerpt = parse_excerpt(query)
+        if self.strategy == "none" or excerpt is None:
+            return query
+        return format_excerpt(excerpt, self.compress(excerpt))
+
+    # Function to give the user message for a prompt: the query itself, or the
+    # parsed excerpt with R compressed
+    def request_text(self, prompt):
+        excerpt = prompt.get("excerpt")
+        if self.strategy == "none" or excerpt is None:
+            return prompt["query"]
+        response = self.compress(excerpt)
+        self.rows += 1
+        self.original_tokens += estimate_tokens(excerpt.response)
+        self.kept_tokens += estimate_tokens(response) if response is not None else 0
+        return format_excerpt(excerpt, response)
+
+    def report(self):
+        if not self.rows:
+            return
+        saved = 1 - self.kept_tokens / max(self.original_tokens, 1)
+        print(
+            f"Response compression ({self.setting}): R cut from "
+            f"{self.original_tokens} to {self.kept_tokens} estimated tokens "
+            f"over {self.rows} rows ({saved:.2%} saved)"
+        )
+
+
+def parse_compression(setting):
+    strategy, _, budget = setting.partition(":")
+    if strategy not in COMPRESSION_STRATEGIES:
+        raise ValueError(
+            f"unknown response compression {setting!r}, "
+            f"expected one of {', '.join(COMPRESSION_STRATEGIES)}"
+        )
+    return ResponseCompressor(strategy, int(budget) if budget else DEFAULT_BUDGET)
+
+
+# Function to pick the compressor for a request shared by several axes: the
+# one that keeps the most of R, so no axis loses context it is set to need
+def widest_compressor(settings):
+    return max(
+        (parse_compression(setting) for setting in settings),
+        key=lambda compressor: compressor.capacity,
+    )
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# CPU-only fast path: a character n-gram TF-IDF nearest-neighbour index over
+# already-labelled rows. Rows that closely match a labelled row are assigned
+# its label without an API call; everything else still goes to the LLM.
+#
+# Calibrate the threshold on the labelled data before using it in a run:
+#   python -m classifier.fast_path axis1 Manualcodingoutput.csv --results model_responses_gpt4.csv
+import argparse
+import collections
+import csv
+
+import numpy as np
+from scipy import sparse
+
+from classifier.core import load_axis
+from classifier.pipeline import SOURCE_ROW_COLUMN, column_names, read_rows
+
+# Queries compared with the labelled rows at a time. The similarity block is
+# dense (queries x labelled rows), so this bounds its memory on large pools.
+QUERY_CHUNK_ROWS = 64
+
+
+# Character n-gram TF-IDF vectors (sublinear tf, L2-normalised) over the most
+# frequent n-grams of the fitted texts. Character n-grams work for Korean
+# without a tokenizer and are robust to spacing and particle variations.
+# A row has a few hundred n-grams at most, so vectors are sparse CSR rows.
+class CharNgramVectorizer:
+    def __init__(self, ngram_range=(2, 4), max_features=8192):
+        self.ngram_range = ngram_range
+        self.max_features = max_features
+        self.vocabulary = {}
+        self.idf = None
+
+    def _ngrams(self, text):
+        text = f" {' '.join(text.lower().split())} "
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for i in range(len(text) - n + 1):
+                yield text[i : i + n]
+
+    def fit(self, texts):
+        document_frequency = collections.Counter()
+        for text in texts:
+            document_frequency.update(set(self._ngrams(text)))
+        most_common = document_frequency.most_common(self.max_features)
+        self.vocabulary = {gram: i for i, (gram, _) in enumerate(most_common)}
+        df = np.array([count for _, count in most_common], dtype=np.float32)
+        self.idf = np.log((1 + len(texts)) / (1 + df)) + 1
+        return self
+
+    def transform(self, texts):
+        columns, values, row_starts = [], [], [0]
+        for text in texts:
+            counts = collections.Counter(
+                gram for gram in self._ngrams(text) if gram in self.vocabulary
+            )
+            row_columns = np.array(
+                [self.vocabulary[gram] for gram in counts], dtype=np.int32
+            )
+            row_values = 1 + np.log(np.array(list(counts.values()), dtype=np.float32))
+            row_values *= self.idf[row_columns]
+            row_values /= max(float(np.linalg.norm(row_values)), 1e-12)
+            columns.append(row_columns)
+            values.append(row_values)
+            row_starts.append(row_starts[-1] + len(row_columns))
+        return sparse.csr_matrix(
+            (
+                np.concatenate(values) if values else np.zeros(0, np.float32),
+                np.concatenate(columns) if columns else np.zeros(0, np.int32),
+                np.array(row_starts),
+            ),
+            shape=(len(texts), len(self.vocabulary)),
+        )
+
+
+# Function to yield (row offset, dense cosine similarities) of `texts` against
+# the fitted `vectors`, QUERY_CHUNK_ROWS query rows at a time
+def similarity_chunks(vectorizer, vectors, texts):
+    labelled = vectors.T.tocsr()
+    for start in range(0, len(texts), QUERY_CHUNK_ROWS):
+        queries = vectorizer.transform(texts[start : start + QUERY_CHUNK_ROWS])
+        yield start, (queries @ labelled).toarray()
+
+
+# Function to index labelled rows by row ID: {row_id: [positions]}
+def row_id_index(row_ids):
+    index = collections.defaultdict(list)
+    for i, row_id in enumerate(row_ids):
+        index[row_id].append(i)
+    return index
+
+
+# Function to rule out each query's own labelled row in a (queries x labelled
+# rows) similarity matrix, for leave-one-out evaluation on the labelled data
+def exclude_own_rows(similarities, query_row_ids, index):
+    for i, row_id in enumerate(query_row_ids):
+        own = index.get(row_id)
+        if own:
+            similarities[i, own] = -1.0
+
+
+# Nearest-neighbour label assignment. A row is accepted when its best cosine
+# similarity is at least `threshold` and beats the closest row of any other
+# label by at least `margin`.
+class FastPathClassifier:
+    def __init__(
+        self,
+        texts,
+        labels,
+        row_ids=None,
+        threshold=0.85,
+        margin=0.1,
+        max_features=8192,
+    ):
+        if not texts:
+            raise ValueError("the fast path needs at least one labelled row")
+        self.vectorizer = CharNgramVectorizer(max_features=max_features).fit(texts)
+        self.vectors = self.vectorizer.transform(texts)
+        self.label_names = sorted(set(labels))
+        label_ids = np.array([self.label_names.index(label) for label in labels])
+        self.label_masks = [label_ids == i for i in range(len(self.label_names))]
+        self.row_index = row_id_index(row_ids or [])
+        self.threshold = threshold
+        self.margin = margin
+        self.checked = 0
+        self.assigned = 0
+        self.correct = 0
+
+    # Best label per text, its similarity and its margin over the runner-up label.
+    # With `row_ids` (calibration on the labelled rows themselves) each text's
+    # own labelled row is left out.
+    def score(self, texts, row_ids=None):
+        per_label = np.empty((len(texts), len(self.label_names)), dtype=np.float32)
+        for start, similarities in similarity_chunks(
+            self.vectorizer, self.vectors, texts
+        ):
+            rows = slice(start, start + len(similarities))
+            if row_ids is not None:
+                exclude_own_rows(similarities, row_ids[rows], self.row_index)
+            for i, mask in enumerate(self.label_masks):
+                per_label[rows, i] = similarities[:, mask].max(axis=1)
+        order = np.argsort(-per_label, axis=1)
+        rows = np.arange(len(texts))
+        best = per_label[rows, order[:, 0]]
+        if len(self.label_names) > 1:
+            runner_up = per_label[rows, order[:, 1]]
+        else:
+            runner_up = np.full(len(texts), -1.0, dtype=np.float32)
+        labels = [self.label_names[i] for i in order[:, 0]]
+        return labels, best, best - runner_up
+
+    # Returns (label, similarity, margin) for confident rows and None otherwise
+    def predict(self, texts):
+        labels, best, margins = self.score(texts)
+        accepted = (best >= self.threshold) & (margins >= self.margin)
+        return [
+            (label, float(similarity), float(margin)) if ok else None
+            for label, similarity, margin, ok in zip(labels, best, margins, accepted)
+        ]
+
+    def report(self, axis_name):
+        reduction = self.assigned / self.checked if self.checked else 0
+        accuracy = self.correct / self.assigned if self.assigned else 0
+        print(
+            f"Fast path ({axis_name}): {self.assigned} of {self.checked} rows labelled "
+            f"locally ({reduction:.2%}), {accuracy:.2%} correct against gold"
+        )
+
+
+# Function to read labelled rows for an axis: (row_ids, queries, label names)
+# from a CSV, Parquet or Arrow file with the axis gold column, plus the axis's
+# few-shot examples.
+# Rows whose gold code does not map to a label are skipped. A row's ID is its
+# source row ID when the file records one, its position otherwise.
+def read_labelled_rows(axis, labelled_csv_path):
+    code_to_label = {code: label for label, code in axis.labels.items()}
+    row_ids, texts, labels = [], [], []
+    columns = ["query", axis.gold_column]
+    if SOURCE_ROW_COLUMN in column_names(labelled_csv_path):
+        columns.append(SOURCE_ROW_COLUMN)
+    for row_id, row in enumerate(read_rows(labelled_csv_path, columns)):
+        label = code_to_label.get(row[axis.gold_column].strip())
+        if label:
+            row_ids.append(row.get(SOURCE_ROW_COLUMN) or str(row_id))
+            texts.append(row["query"])
+            labels.append(label)
+    for i in range(0, len(axis.examples) - 1, 2):
+        user, assistant = axis.examples[i], axis.examples[i + 1]
+        if assistant["content"] in axis.labels:
+            row_ids.append(f"example-{i // 2}")
+            texts.append(user["content"])
+            labels.append(assistant["content"])
+    return row_ids, texts, labels
+
+
+def build_fast_path(axis, labelled_csv_path, threshold=0.85, margin=0.1):
+    row_ids, texts, labels = read_labelled_rows(axis, labelled_csv_path)
+    if not texts:
+        raise ValueError(f"{labelled_csv_path} has no rows labelled for {axis.name}")
+    return FastPathClassifier(
+        texts, labels, row_ids, threshold=threshold, margin=margin
+    )
+
+
+# Function to read {row_id: correct_classification} from an earlier LLM run
+def read_llm_results(results_csv_path):
+    with open(results_csv_path, mode="r", encoding="utf-8") as csvfile:
+        return {
+            row["row_id"]: row["correct_classification"] == "True"
+            for row in csv.DictReader(csvfile)
+        }
+
+
+# Leave-one-out calibration over the labelled rows: for each threshold, the
+# share of rows the fast path would answer (= API calls saved) and its
+# accuracy on them, compared with an earlier LLM run on the same rows
+def calibrate(axis, labelled_csv_path, results_csv_path=None, margin=0.1):
+    fast_path = build_fast_path(axis, labelled_csv_path, margin=margin)
+    row_ids, texts, labels = read_labelled_rows(axis, labelled_csv_path)
+    predicted, similarities, margins = [], [], []
+    for start in range(0, len(texts), 1000):
+        batch = slice(start, start + 1000)
+        batch_labels, best, batch_margins = fast_path.score(
+            texts[batch], row_ids[batch]
+        )
+        predicted += batch_labels
+        similarities.append(best)
+        margins.append(batch_margins)
+    similarities = np.concatenate(similarities)
+    margins = np.concatenate(margins)
+    correct = np.array([p == label for p, label in zip(predicted, labels)])
+
+    llm_results = read_llm_results(results_csv_path) if results_csv_path else {}
+    llm_correct = np.array([llm_results.get(row_id) for row_id in row_ids])
+    has_llm = np.array([result is not None for result in llm_correct])
+
+    # The delta compares fast path and LLM on the covered rows both have answers for
+    print("threshold  calls saved  fast-path acc  LLM acc  delta")
+    for threshold in np.arange(0.5, 1.0, 0.05):
+        covered = (similarities >= threshold) & (margins >= margin)
+        if not covered.any():
+            print(f"{threshold:9.2f}  {0:10.2%}  {'-':>13}  {'-':>7}  {'-':>5}")
+            continue
+        fast_accuracy = correct[covered].mean()
+        compared = covered & has_llm
+        if compared.any():
+            llm_accuracy = llm_correct[compared].astype(bool).mean()
+            fast_on_compared = correct[compared].mean()
+            llm_text = f"{llm_accuracy:7.2%}"
+            delta_text = f"{fast_on_compared - llm_accuracy:+.2%}"
+        else:
+            llm_text, delta_text = f"{'-':>7}", "-"
+        print(
+            f"{threshold:9.2f}  {covered.mean():10.2%}  {fast_accuracy:13.2%}  "
+            f"{llm_text}  {delta_text}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the fast-path threshold")
+    parser.add_argument("axis", help="axis name, e.g. axis1")
+    parser.add_argument("labelled", help="CSV with query and gold columns")
+    parser.add_argument("--results", help="earlier LLM output CSV to compare with")
+    parser.add_argument("--margin", type=float, default=0.1)
+    args = parser.parse_args()
+    calibrate(load_axis(args.axis), args.labelled, args.results, args.margin)
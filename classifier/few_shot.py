@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Dynamic few-shot examples: instead of inlining every example in the system
+# prompt, each row is sent with the k labelled rows most similar to it, found
+# with the fast path's character n-gram TF-IDF index. A per-label cap keeps
+# one frequent label from filling every slot.
+#
+# Compare token cost and accuracy against the full inline prompt:
+#   python -m classifier.few_shot axis1 Manualcodingoutput.csv --k 2,4,8
+import argparse
+import itertools
+import json
+
+import dotenv
+import numpy as np
+
+from classifier.cache import ResponseCache
+from classifier.core import (
+    build_messages,
+    build_system_prompt,
+    cache_path,
+    generate_responses,
+    is_correct_classification,
+    load_axis,
+    make_engine,
+    read_prompts,
+)
+from classifier.engine import estimate_message_tokens, estimate_tokens
+from classifier.fast_path import (
+    CharNgramVectorizer,
+    exclude_own_rows,
+    read_labelled_rows,
+    row_id_index,
+    similarity_chunks,
+)
+from classifier.pipeline import SOURCE_ROW_COLUMN, column_names, read_rows
+from classifier.structured import example_answer
+
+# Candidates looked at per selected example before the label cap gives up
+CANDIDATES_PER_EXAMPLE = 20
+
+
+# Function to read labelled rows for the given axes: (row_ids, queries,
+# {axis name: label} dicts). A combined run only uses rows labelled on every
+# axis; a single-axis run also gets the axis's own few-shot examples.
+def read_labelled_examples(axes, labelled_path):
+    if len(axes) == 1:
+        row_ids, texts, labels = read_labelled_rows(axes[0], labelled_path)
+        return row_ids, texts, [{axes[0].name: label} for label in labels]
+    code_to_label = {
+        axis.name: {code: label for label, code in axis.labels.items()}
+        for axis in axes
+    }
+    row_ids, texts, labels = [], [], []
+    columns = ["query"] + [axis.gold_column for axis in axes]
+    if SOURCE_ROW_COLUMN in column_names(labelled_path):
+        columns.append(SOURCE_ROW_COLUMN)
+    for row_id, row in enumerate(read_rows(labelled_path, columns)):
+        row_labels = {
+            axis.name: code_to_label[axis.name].get(row[axis.gold_column].strip())
+            for axis in axes
+        }
+        if all(row_labels.values()):
+            row_ids.append(row.get(SOURCE_ROW_COLUMN) or str(row_id))
+            texts.append(row["query"])
+            labels.append(row_labels)
+    return row_ids, texts, labels
+
+
+# Picks up to `k` examples per query, most similar first, with at most
+# `per_label` examples of the same answer. With `leave_one_out`, for
+# evaluating on the labelled rows themselves, a row never retrieves its own
+# labelled row (matched by row ID). Examples are sent as user and assistant
+# turns after the system prompt, the closest one last.
+class FewShotSelector:
+    def __init__(
+        self,
+        texts,
+        answers,
+        row_ids=None,
+        k=6,
+        per_label=2,
+        max_features=8192,
+        leave_one_out=False,
+    ):
+        self.texts = texts
+        self.answers = answers
+        self.vectorizer = CharNgramVectorizer(max_features=max_features).fit(texts)
+        self.vectors = self.vectorizer.transform(texts)
+        self.row_index = row_id_index(row_ids or [])
+        self.leave_one_out = leave_one_out
+        self.k = k
+        self.per_label = per_label
+        self.rows = 0
+        self.selected = 0
+
+    # Indices of the selected examples per query, most similar first
+    def select(self, queries, row_ids=None):
+        depth = min(len(self.texts), self.k * CANDIDATES_PER_EXAMPLE)
+        selections = []
+        for start, similarities in similarity_chunks(
+            self.vectorizer, self.vectors, queries
+        ):
+            rows = slice(start, start + len(similarities))
+            if row_ids is not None:
+                exclude_own_rows(similarities, row_ids[rows], self.row_index)
+            candidates = np.argpartition(-similarities, depth - 1, axis=1)[:, :depth]
+            for row, row_candidates in zip(similarities, candidates):
+                selections.append(self._pick(row, row_candidates))
+        self.rows += len(queries)
+        self.selected += sum(map(len, selections))
+        return selections
+
+    # Up to `k` of a query's candidate examples, most similar first, with at
+    # most `per_label` of the same answer. Left-out rows score -1.
+    def _pick(self, row, row_candidates):
+        chosen = []
+        label_counts = {}
+        for i in row_candidates[np.argsort(-row[row_candidates])]:
+            answer = self.answers[i]
+            if row[i] < 0 or label_counts.get(answer, 0) >= self.per_label:
+                continue
+            label_counts[answer] = label_counts.get(answer, 0) + 1
+            chosen.append(int(i))
+            if len(chosen) == self.k:
+                break
+        return chosen
+
+    # Function to build the example turns for each prompt; example queries go
+    # through the same R compression as the rows
+    def example_messages(self, prompts, compressor=None):
+        row_ids = None
+        if self.leave_one_out:
+            row_ids = [prompt["row_id"] for prompt in prompts]
+        selections = self.select([prompt["query"] for prompt in prompts], row_ids)
+        message_lists = []
+        for chosen in selections:
+            messages = []
+            for i in reversed(chosen):
+                text = self.texts[i]
+                if compressor is not None:
+                    text = compressor.shorten(text)
+                messages += [
+                    {"role": "user", "content": text},
+                    {"role": "assistant", "content": self.answers[i]},
+                ]
+            message_lists.append(messages)
+        return message_lists
+
+    def report(self):
+        if self.rows:
+            print(
+                f"Few-shot: {self.selected / self.rows:.2f} retrieved examples per "
+                f"row from {len(self.texts)} labelled rows"
+            )
+
+
+def build_few_shot(
+    axes, labelled_path, output_mode="text", k=6, per_label=2, leave_one_out=False
+):
+    row_ids, texts, labels = read_labelled_examples(axes, labelled_path)
+    if not texts:
+        raise ValueError(f"{labelled_path} has no rows labelled on every axis")
+    answers = [example_answer(row_labels, axes, output_mode) for row_labels in labels]
+    return FewShotSelector(
+        texts,
+        answers,
+        row_ids,
+        k=k,
+        per_label=per_label,
+        leave_one_out=leave_one_out,
+    )
+
+
+# Function to classify the same rows with the full inline prompt and with
+# k retrieved examples for each k. Prompt tokens are split into the static
+# system prompt, which prompt caching serves after the first call, and the
+# per-row part (examples and query).
+def compare_prompts(axis, prompts, selectors, engine, cache=None):
+    results = []
+    for name, selector in [("inline", None)] + selectors:
+        system_prompt = build_system_prompt([axis], inline_examples=selector is None)
+        examples = [[]] * len(prompts)
+        if selector is not None:
+            examples = selector.example_messages(prompts)
+        static_tokens = estimate_tokens(system_prompt)
+        total_tokens = sum(
+            estimate_message_tokens(
+                build_messages(system_prompt, prompt["query"], examples=row_examples)
+            )
+            for prompt, row_examples in zip(prompts, examples)
+        )
+        items = generate_responses(prompts, [axis], engine, cache, few_shot=selector)
+        items = [item for item in items if "error" not in item]
+        correct = sum(is_correct_classification(item, axis, [axis]) for item in items)
+        results.append(
+            {
+                "prompt": name,
+                "rows": len(items),
+                "static_tokens": static_tokens,
+                "per_row_tokens": total_tokens / len(prompts) - static_tokens,
+                "accuracy": correct / len(items) if items else 0.0,
+            }
+        )
+    return results
+
+
+def print_comparison(results):
+    baseline = results[0]
+    print("prompt    static tok  per-row tok  total tok/row  accuracy  delta")
+    for result in results:
+        total = result["static_tokens"] + result["per_row_tokens"]
+        delta = result["accuracy"] - baseline["accuracy"]
+        print(
+            f"{result['prompt']:<8}  {result['static_tokens']:10d}  "
+            f"{result['per_row_tokens']:11.1f}  {total:13.1f}  "
+            f"{result['accuracy']:8.2%}  {delta:+.2%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare retrieved few-shot examples with the inline prompt"
+    )
+    parser.add_argument("axis", help="axis name, e.g. axis1")
+    parser.add_argument("labelled", help="input file with query and gold columns")
+    parser.add_argument(
+        "--eval", help="rows to classify (default: the labelled rows, leave-one-out)"
+    )
+    parser.add_argument("--k", default="2,4,8", help="comma-separated example counts")
+    parser.add_argument("--per-label", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=500, help="rows to classify")
+    parser.add_argument("--model", default="gpt-4-0125-preview")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    dotenv.load_dotenv()
+    axis = load_axis(args.axis)
+    eval_path = args.eval or args.labelled
+    # Evaluating on the labelled rows themselves: leave each row's own row out
+    leave_one_out = eval_path == args.labelled
+    selectors = [
+        (
+            f"k={k}",
+            build_few_shot(
+                [axis],
+                args.labelled,
+                k=int(k),
+                per_label=args.per_label,
+                leave_one_out=leave_one_out,
+            ),
+        )
+        for k in args.k.split(",")
+    ]
+    prompts = list(itertools.islice(read_prompts(eval_path, [axis]), args.limit))
+    cache = None if args.no_cache else ResponseCache(cache_path)
+    engine = make_engine(args.model, concurrency=args.concurrency)
+    results = compare_prompts(axis, prompts, selectors, engine, cache)
+    print_comparison(results)
+    engine.usage.report()
+    if cache is not None:
+        cache.close()
+    if args.json:
+        with open(args.json, mode="w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import collections
+import difflib
+import re
+import unicodedata
+
+# Result of matching a model answer to a label. `label` is None when nothing
+# matched. `confidence` orders the match methods: 1.0 exact, 0.95 after
+# normalization or via an alias, 0.9 a bare number, 0.8 a single label found
+# inside longer text, and 0.8 x similarity for a fuzzy match.
+LabelMatch = collections.namedtuple("LabelMatch", ["label", "confidence", "method"])
+
+NO_MATCH = LabelMatch(None, 0.0, "none")
+
+# Lead-ins models put before the label: "Taxonomy: ", "Label - ", "4. ", "2A) "
+ANSWER_PREFIX = re.compile(
+    r"^(?:(?:taxonomy|label|classification|category|answer)\s*[:=-]\s*)*"
+    r"(?:\d{1,2}[a-d]?\s*[.):]\s+)?"
+)
+# A numbered label line in an axis prompt, e.g. "5. Confirming Response - When ..."
+NUMBERED_LABEL = re.compile(r"^\s*(\d{1,2})\.\s+(.+?)(?:\s+-\s|\s*$)", re.MULTILINE)
+
+
+# Function to fold case, width and whitespace, and strip surrounding
+# punctuation and markdown, so equivalent answers compare equal
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"\s*/\s*", "/", text)
+    text = " ".join(text.split())
+    return text.strip(" .,;:!?\"'`*_()[]{}")
+
+
+# Maps free-form answers to one of an axis's labels. The lookup tables and the
+# label search pattern are built once per axis; repeated answers are memoized.
+class LabelMatcher:
+    def __init__(
+        self, labels, system_prompt="", aliases=None, fuzzy_cutoff=0.85, memo_size=10000
+    ):
+        self.labels = labels
+        self.index = {normalize_text(label): label for label in labels}
+        for alias, label in (aliases or {}).items():
+            self.index[normalize_text(alias)] = label
+
+        # A bare number refers to the numbering the model saw in the prompt,
+        # which is not always the label code; fall back to the code otherwise
+        self.numbers = {code: label for label, code in labels.items()}
+        # The number each label has in the prompt, for answering in code mode
+        self.label_numbers = dict(labels)
+        for number, name in NUMBERED_LABEL.findall(system_prompt):
+            label = self.index.get(normalize_text(name))
+            if label:
+                self.numbers[number] = label
+                self.label_numbers[label] = number
+
+        keys = sorted(self.index, key=len, reverse=True)
+        self.search_pattern = re.compile(
+            r"(?<!\w)(?:" + "|".join(map(re.escape, keys)) + r")(?!\w)"
+        )
+        self.fuzzy_cutoff = fuzzy_cutoff
+        # Longer answers are not fuzzy matched; they are explanations, not typos
+        self.fuzzy_max_length = max(map(len, keys)) + 8
+        self.memo = {}
+        self.memo_size = memo_size
+
+    def match(self, text):
+        if text in self.labels:
+            return LabelMatch(text, 1.0, "exact")
+        match = self.memo.get(text)
+        if match is None:
+            match = self._match(text)
+            if len(self.memo) < self.memo_size:
+                self.memo[text] = match
+        return match
+
+    def _match(self, text):
+        normalized = normalize_text(text)
+        candidate = normalize_text(ANSWER_PREFIX.sub("", normalized))
+        for key in (normalized, candidate):
+            if key in self.index:
+                return LabelMatch(self.index[key], 0.95, "normalized")
+        if candidate in self.numbers:
+            return LabelMatch(self.numbers[candidate], 0.9, "number")
+
+        found = {self.index[key] for key in self.search_pattern.findall(normalized)}
+        if len(found) == 1:
+            return LabelMatch(found.pop(), 0.8, "contains")
+        if found:
+            # Several different labels mentioned: ambiguous
+            return NO_MATCH
+
+        if candidate and len(candidate) <= self.fuzzy_max_length:
+            close = difflib.get_close_matches(
+                candidate, self.index, n=1, cutoff=self.fuzzy_cutoff
+            )
+            if close:
+                ratio = difflib.SequenceMatcher(None, candidate, close[0]).ratio()
+                return LabelMatch(self.index[close[0]], round(0.8 * ratio, 2), "fuzzy")
+        return NO_MATCH
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pipeline stages timed per chunk: pulling rows from the input, waiting for
+# the model, matching and scoring answers, and writing results
+STAGES = ("read", "infer", "parse", "write")
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Live instrumentation of one run: rows/sec, in-flight requests, retries and
+# failures (read from the engine), running accuracy per gold label and time
+# per stage. Progress is printed at most every `progress_interval` seconds,
+# events go to a JSON-lines log, and with `metrics_port` the same numbers are
+# served in the Prometheus text format at http://127.0.0.1:<port>/metrics.
+# `label_columns` maps each correctness column to (gold column, {code: label}).
+class RunMetrics:
+    def __init__(
+        self,
+        engine=None,
+        total_rows=None,
+        label_columns=None,
+        progress_interval=10.0,
+        event_log_path=None,
+        metrics_port=None,
+        name="",
+        resume=False,
+    ):
+        self.engine = engine
+        self.total_rows = total_rows
+        self.label_columns = label_columns or {}
+        self.progress_interval = progress_interval
+        self.name = name
+        self.started = time.monotonic()
+        self.last_progress = self.started
+        self.rows = 0
+        self.skipped_rows = 0
+        self.failed_rows = 0
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        # Seconds spent in nested stages, per open stage
+        self.open_stages = []
+        # (correctness column, label) -> [rows, correct]
+        self.label_counts = collections.defaultdict(lambda: [0, 0])
+        # Run totals of per-chunk work such as packing and re-queries, reported
+        # once at the end instead of printed per chunk
+        self.totals = collections.defaultdict(collections.Counter)
+        # Guards label_counts against a metrics scrape from the server thread
+        self.lock = threading.Lock()
+        self.event_log = None
+        if event_log_path:
+            mode = "a" if resume else "w"
+            self.event_log = open(event_log_path, mode=mode, encoding="utf-8")
+        self.server = None
+        if metrics_port:
+            self.server = start_metrics_server(self, metrics_port)
+
+    # Time a stage. Stages may nest, e.g. parsing inside a `generate` call
+    # timed as inference; nested time counts only towards the inner stage.
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        self.open_stages.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.stage_seconds[name] += elapsed - self.open_stages.pop()
+            if self.open_stages:
+                self.open_stages[-1] += elapsed
+
+    def event(self, kind, **fields):
+        if self.event_log is None:
+            return
+        record = {"time": round(time.time(), 3), "event": kind, **fields}
+        self.event_log.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def in_flight(self):
+        return getattr(self.engine, "in_flight", 0)
+
+    # Add one chunk's counts to the run totals of `kind` and log them
+    def add_totals(self, kind, **counts):
+        self.totals[kind].update(counts)
+        self.event(kind, **counts)
+
+    # Rows already done by an earlier run count towards the total only
+    def record_skipped(self, count):
+        self.skipped_rows += count
+
+    # Record one finished chunk: scored items, failed items and the per-row
+    # events that replace printing every answer
+    def record_chunk(self, items, failures):
+        self.rows += len(items)
+        self.failed_rows += len(failures)
+        for item in items:
+            with self.lock:
+                for column, (gold_column, names) in self.label_columns.items():
+                    label = names.get(item[gold_column].strip(), "unlabelled")
+                    counts = self.label_counts[column, label]
+                    counts[0] += 1
+                    counts[1] += bool(item[column])
+            self.event(
+                "row",
+                row_id=item["row_id"],
+                response=str(item["response"]),
+                correct={column: bool(item[column]) for column in self.label_columns},
+            )
+        for item in failures:
+            self.event("failure", row_id=item["row_id"], error=item["error"])
+        self.event(
+            "chunk",
+            rows=len(items),
+            failures=len(failures),
+            rows_per_second=round(self.rows_per_second(), 2),
+            stage_seconds={k: round(v, 3) for k, v in self.stage_seconds.items()},
+        )
+        if self.event_log is not None:
+            self.event_log.flush()
+        if time.monotonic() - self.last_progress >= self.progress_interval:
+            self.print_progress()
+
+    def accuracy(self, column):
+        with self.lock:
+            counts = [
+                list(c) for (col, _), c in self.label_counts.items() if col == column
+            ]
+        rows = sum(c[0] for c in counts)
+        return sum(c[1] for c in counts) / rows if rows else 0.0
+
+    def print_progress(self):
+        self.last_progress = time.monotonic()
+        done = self.rows + self.skipped_rows
+        rate = self.rows_per_second()
+        progress = f"{done}"
+        if self.total_rows:
+            progress += f"/{self.total_rows} rows ({done / self.total_rows:.1%})"
+            if rate > 0:
+                remaining = max(self.total_rows - done - self.failed_rows, 0)
+                progress += f", ETA {format_duration(remaining / rate)}"
+        else:
+            progress += " rows"
+        accuracies = ", ".join(
+            f"{self.accuracy(column):.2%}" for column in self.label_columns
+        )
+        retries = getattr(self.engine, "retries", 0)
+        label = f" ({self.name})" if self.name else ""
+        print(
+            f"Progress{label}: {progress}, {rate:.1f} rows/s, "
+            f"{self.in_flight()} in flight, {retries} retries, "
+            f"{self.failed_rows} failed, accuracy {accuracies or '-'}"
+        )
+
+    def report_stages(self):
+        total = sum(self.stage_seconds.values())
+        if not total:
+            return
+        print(
+            "Stages: "
+            + ", ".join(
+                f"{stage} {seconds:.1f}s ({seconds / total:.0%})"
+                for stage, seconds in self.stage_seconds.items()
+            )
+        )
+
+    # Prometheus text exposition of the current values
+    def prometheus_text(self):
+        with self.lock:
+            labelled = sorted((key, list(c)) for key, c in self.label_counts.items())
+        metrics = [
+            ("rows_total", "counter", "Rows classified", [({}, self.rows)]),
+            ("rows_failed_total", "counter", "Failed rows", [({}, self.failed_rows)]),
+            (
+                "rows_per_second",
+                "gauge",
+                "Classified rows per second",
+                [({}, round(self.rows_per_second(), 3))],
+            ),
+            (
+                "in_flight_requests",
+                "gauge",
+                "API requests in flight",
+                [({}, self.in_flight())],
+            ),
+            (
+                "request_retries_total",
+                "counter",
+                "Retried API requests",
+                [({}, getattr(self.engine, "retries", 0))],
+            ),
+            (
+                "request_failures_total",
+                "counter",
+                "API requests that gave up",
+                [({}, getattr(self.engine, "failures", 0))],
+            ),
+            (
+                "label_rows_total",
+                "counter",
+                "Scored rows per gold label",
+                [({"column": c, "label": l}, n[0]) for (c, l), n in labelled],
+            ),
+            (
+                "label_correct_total",
+                "counter",
+                "Correctly classified rows per gold label",
+                [({"column": c, "label": l}, n[1]) for (c, l), n in labelled],
+            ),
+            (
+                "stage_seconds_total",
+                "counter",
+                "Seconds spent per pipeline stage",
+                [({"stage": s}, round(t, 3)) for s, t in self.stage_seconds.items()],
+            ),
+        ]
+        lines = []
+        for name, kind, help_text, samples in metrics:
+            lines.append(f"# HELP classifier_{name} {help_text}")
+            lines.append(f"# TYPE classifier_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{escape_label_value(val)}"' for key, val in labels.items()
+                )
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"classifier_{name}{label_text} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.rows or self.failed_rows:
+            self.print_progress()
+        self.report_stages()
+        self.event(
+            "finished",
+            rows=self.rows,
+            failures=self.failed_rows,
+            seconds=round(time.monotonic() - self.started, 3),
+            stage_seconds={k: round(v, 3) for k, v in self.stage_seconds.items()},
+        )
+        if self.event_log is not None:
+            self.event_log.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes are not worth a line on stdout each
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to serve `metrics` on a local port from a background thread
+def start_metrics_server(metrics, port):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+    return server
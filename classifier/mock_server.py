@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+# Local stand-in for the OpenAI chat completions, file upload and batch
+# endpoints, used to exercise the classifiers without spending API credits.
+# Point the scripts at it with
+#   OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=test python Classifier_Axis1.py
+import argparse
+import collections
+import email.parser
+import email.policy
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from classifier.engine import estimate_message_tokens, estimate_tokens
+
+# Matches the request for K answers that packing mode adds to the user message
+PACKED_REQUEST = re.compile(r"Return a JSON array of exactly (\d+) answers\.")
+# Matches the heading before each excerpt of a packed user message
+PACKED_EXCERPT = re.compile(r"(?:\A|\n\n)Excerpt \d+:\n")
+# Matches the per-axis headings of a combined multi-axis system prompt
+AXIS_HEADING = re.compile(r"^Axis: (\w+)$", re.MULTILINE)
+
+LATENCY_DISTRIBUTIONS = ("uniform", "lognormal", "exponential")
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for many concurrent connections; the socketserver default is 5
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address,
+        latency=0.0,
+        jitter=0.0,
+        reply="Unclassified",
+        script=(),
+        retry_after=None,
+        distribution="uniform",
+        error_rate=0.0,
+        error_codes=(429, 500, 503),
+        answers=None,
+        noise_reply=None,
+        noise_rate=0.0,
+    ):
+        super().__init__(address, MockOpenAIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.reply = reply
+        # {query: {axis name: label}}; known queries are answered with these
+        # labels instead of `reply`, e.g. the gold labels for benchmarks
+        self.answers = answers or {}
+        # With probability noise_rate an axis is answered with noise_reply
+        # instead, so repeated samples disagree
+        self.noise_reply = noise_reply
+        self.noise_rate = noise_rate
+        # Status codes returned by successive chat requests before normal replies,
+        # e.g. (429, 500, 200) to exercise retries; retry_after sets the header
+        self.script = collections.deque(script)
+        self.retry_after = retry_after
+        # After the script, each request fails with this probability
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.error_count = 0
+        self.request_count = 0
+        # Token estimates of the system prompts seen so far; a prompt in here
+        # is reported as cached by later requests
+        self.prefix_tokens = {}
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    # Artificial per-request latency around `latency`: uniformly jittered by
+    # `jitter` seconds, lognormal with median `latency` and sigma `jitter`, or
+    # exponential with mean `latency`
+    def delay(self):
+        if self.distribution == "lognormal":
+            return random.lognormvariate(math.log(max(self.latency, 1e-6)), self.jitter)
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def next_status(self):
+        with self.lock:
+            if self.script:
+                status = self.script.popleft()
+            elif self.error_rate and random.random() < self.error_rate:
+                status = random.choice(self.error_codes)
+            else:
+                status = 200
+            self.error_count += status != 200
+            return status
+
+    # The queries a request classifies and whether it is packed: the excerpts
+    # of a packed message, else the last user message with a stored answer.
+    # Few-shot examples come before the row and a re-query's instructions
+    # after it, so neither is mistaken for the row.
+    def request_queries(self, messages):
+        user_messages = [m["content"] for m in messages if m["role"] == "user"]
+        for content in reversed(user_messages):
+            packed = PACKED_REQUEST.search(content)
+            if packed:
+                excerpts = content[: packed.start()].removesuffix("\n\n")
+                return PACKED_EXCERPT.split(excerpts)[1:], True
+            if content in self.answers:
+                return [content], False
+        return user_messages[-1:] or [""], False
+
+    # The reply for one query: its stored answer if known, else `reply`
+    def answer(self, query, axes):
+        labels = self.answers.get(query)
+        if axes:
+            labels = labels or {}
+            return {axis: self.noisy(labels.get(axis, self.reply)) for axis in axes}
+        return self.noisy(next(iter(labels.values())) if labels else self.reply)
+
+    def noisy(self, reply):
+        if self.noise_reply is not None and random.random() < self.noise_rate:
+            return self.noise_reply
+        return reply
+
+    # Imitates provider prompt caching: a system prompt seen before is reported
+    # as cached in 128-token blocks once it is at least 1024 tokens long
+    def cached_prefix_tokens(self, messages):
+        if not messages:
+            return 0
+        system_prompt = messages[0]["content"]
+        with self.lock:
+            tokens = self.prefix_tokens.get(system_prompt)
+        if tokens is None:
+            tokens = estimate_message_tokens(messages[:1])
+            with self.lock:
+                self.prefix_tokens[system_prompt] = tokens
+            return 0
+        return tokens // 128 * 128 if tokens >= 1024 else 0
+
+    # Split the reply into four-character "tokens" with fixed high logprobs
+    def logprobs(self, content):
+        tokens = [content[i : i + 4] for i in range(0, len(content), 4)]
+        return {
+            "content": [
+                {"token": token, "logprob": -0.01, "bytes": None, "top_logprobs": []}
+                for token in tokens
+            ]
+        }
+
+    def chat_completion(self, body):
+        with self.lock:
+            self.request_count += 1
+        messages = body.get("messages", [])
+        axes = AXIS_HEADING.findall(messages[0]["content"]) if messages else []
+        queries, packed = self.request_queries(messages)
+        answer = self.answer(queries[0] if queries else "", axes)
+        content = json.dumps(answer, ensure_ascii=False) if axes else answer
+        if packed:
+            # Each excerpt is answered on its own
+            answers = [self.answer(query, axes) for query in queries]
+            content = json.dumps(answers, ensure_ascii=False)
+        message = {"role": "assistant", "content": content}
+        tools = body.get("tools")
+        if tools:
+            # Forced function call: the reply if the enum allows it, else its
+            # first label, as the call's arguments
+            function = tools[0]["function"]
+            properties = function["parameters"]["properties"]
+            if not isinstance(answer, dict):
+                answer = dict.fromkeys(properties, answer)
+            structured = {}
+            for name, spec in properties.items():
+                label = answer.get(name)
+                structured[name] = label if label in spec["enum"] else spec["enum"][0]
+            content = json.dumps(structured, ensure_ascii=False)
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex}",
+                        "type": "function",
+                        "function": {"name": function["name"], "arguments": content},
+                    }
+                ],
+            }
+        cached_tokens = self.cached_prefix_tokens(messages)
+        # The system prompt estimate is memoized by cached_prefix_tokens
+        prompt_tokens = estimate_message_tokens(messages[1:])
+        if messages:
+            prompt_tokens += self.prefix_tokens[messages[0]["content"]]
+        completion_tokens = estimate_tokens(content)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "logprobs": (
+                        self.logprobs(content) if body.get("logprobs") else None
+                    ),
+                    "finish_reason": "tool_calls" if tools else "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def create_file(self, filename, purpose, data):
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = data
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+
+    def create_batch(self, body):
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.batches[batch["id"]] = batch
+        thread = threading.Thread(target=self.process_batch, args=(batch,))
+        thread.daemon = True
+        thread.start()
+        return batch
+
+    # Answer every line of the input file, then publish an output file
+    def process_batch(self, batch):
+        lines = self.files[batch["input_file_id"]].decode("utf-8").splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        batch["request_counts"]["total"] = len(requests)
+        results = []
+        for request in requests:
+            time.sleep(self.delay())
+            body = self.chat_completion(request["body"])
+            results.append(
+                {
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": body},
+                    "error": None,
+                }
+            )
+            batch["request_counts"]["completed"] += 1
+        output = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+        output_file = self.create_file(
+            "batch_output.jsonl", "batch_output", output.encode("utf-8")
+        )
+        batch["output_file_id"] = output_file["id"]
+        batch["status"] = "completed"
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Scripted API error, with a Retry-After header on rate limits
+    def _send_error(self, status):
+        data = json.dumps(
+            {"error": {"message": f"Scripted error {status}", "type": "mock_error"}}
+        ).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429 and self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_not_found(self):
+        self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    # Minimal multipart/form-data parsing for file uploads
+    def _read_multipart(self):
+        length = int(self.headers.get("Content-Length", 0))
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n"
+        message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+            header.encode("utf-8") + self.rfile.read(length)
+        )
+        fields, filename, data = {}, "upload.jsonl", b""
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                filename, data = part.get_filename(), part.get_payload(decode=True)
+            else:
+                fields[name] = part.get_payload(decode=True).decode("utf-8")
+        return fields, filename, data
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            body = self._read_json()
+            time.sleep(self.server.delay())
+            status = self.server.next_status()
+            if status == 200:
+                self._send_json(self.server.chat_completion(body))
+            else:
+                self._send_error(status)
+        elif path.endswith("/files"):
+            fields, filename, data = self._read_multipart()
+            purpose = fields.get("purpose", "batch")
+            self._send_json(self.server.create_file(filename, purpose, data))
+        elif path.endswith("/batches"):
+            self._send_json(self.server.create_batch(self._read_json()))
+        else:
+            self._send_not_found()
+
+    def do_GET(self):
+        parts = self.path.rstrip("/").split("/")
+        if parts[-2] == "batches" and parts[-1] in self.server.batches:
+            self._send_json(self.server.batches[parts[-1]])
+        elif parts[-1] == "content" and parts[-2] in self.server.files:
+            data = self.server.files[parts[-2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_not_found()
+
+
+# Start a mock server on a background thread; port 0 picks a free port
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    server = MockOpenAIServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="seconds per request"
+    )
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument(
+        "--distribution", choices=LATENCY_DISTRIBUTIONS, default="uniform"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of requests that fail"
+    )
+    parser.add_argument("--noise-reply", help="reply sometimes given instead")
+    parser.add_argument(
+        "--noise-rate", type=float, default=0.0, help="share of noise replies"
+    )
+    parser.add_argument("--reply", default="Unclassified")
+    parser.add_argument(
+        "--script",
+        default="",
+        help="comma-separated status codes for the first requests, e.g. 429,500",
+    )
+    parser.add_argument(
+        "--retry-after", type=float, help="Retry-After seconds on scripted 429s"
+    )
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        reply=args.reply,
+        script=[int(code) for code in args.script.split(",") if code],
+        retry_after=args.retry_after,
+        distribution=args.distribution,
+        error_rate=args.error_rate,
+        noise_reply=args.noise_reply,
+        noise_rate=args.noise_rate,
+    )
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    server.serve_forever()
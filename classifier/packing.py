@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+
+from classifier.cache import ResponseCache
+from classifier.engine import RequestFailure, extract_response_text, total_tokens
+
+# Appended to the axis system prompt in packing mode. The number of excerpts
+# goes into the user message so the system prompt stays identical across calls.
+PACKING_INSTRUCTIONS = """
+
+You will receive several numbered excerpts at once instead of a single one. Classify each excerpt independently, exactly as instructed above. Reply only with a JSON array of strings, one answer per excerpt in the same order, and nothing else."""
+
+CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def packed_system_prompt(system_prompt):
+    return system_prompt + PACKING_INSTRUCTIONS
+
+
+# Number the excerpts and tell the model how many answers to return
+def pack_queries(queries):
+    excerpts = "\n\n".join(
+        f"Excerpt {i}:\n{query}" for i, query in enumerate(queries, start=1)
+    )
+    return f"{excerpts}\n\nReturn a JSON array of exactly {len(queries)} answers."
+
+
+# Parse a packed reply into a list of `count` labels, or None if it is unusable.
+# Combined multi-axis answers come back as JSON objects and are kept as JSON text.
+def parse_packed_labels(text, count):
+    try:
+        labels = json.loads(CODE_FENCE.sub("", text.strip()))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(labels, list) or len(labels) != count:
+        return None
+    if not all(isinstance(label, (str, dict)) for label in labels):
+        return None
+    return [
+        label.strip()
+        if isinstance(label, str)
+        else json.dumps(label, ensure_ascii=False)
+        for label in labels
+    ]
+
+
+# Classify the queries `pack_size` at a time. Packs whose reply does not parse
+# into exactly one label per excerpt are retried as single-item calls.
+# Returns the response texts in input order. Rows, calls and tokens are added
+# to the run totals of `metrics`.
+def complete_packed(
+    engine,
+    system_prompt,
+    queries,
+    pack_size,
+    cache=None,
+    row_tags=None,
+    metrics=None,
+):
+    packed_prompt = packed_system_prompt(system_prompt)
+    single_message_lists = [
+        [
+            {"role": "system", "content": packed_prompt},
+            {"role": "user", "content": query},
+        ]
+        for query in queries
+    ]
+    keys = [
+        ResponseCache.make_key(engine.model, messages, engine.request_kwargs)
+        for messages in single_message_lists
+    ]
+    response_texts = [None] * len(queries)
+    if cache is not None:
+        response_texts = [cache.get(key) for key in keys]
+        # Release the write lock the last_used updates took before the requests
+        cache.connection.commit()
+    pending = [i for i, text in enumerate(response_texts) if text is None]
+
+    packs = [pending[i : i + pack_size] for i in range(0, len(pending), pack_size)]
+    packed_message_lists = [
+        [
+            {"role": "system", "content": packed_prompt},
+            {"role": "user", "content": pack_queries([queries[i] for i in pack])},
+        ]
+        for pack in packs
+    ]
+    packed_responses = engine.run(packed_message_lists) if packs else []
+
+    fallback = []
+    for pack, response in zip(packs, packed_responses):
+        text = extract_response_text(response)
+        labels = None
+        if not isinstance(text, RequestFailure):
+            labels = parse_packed_labels(text, len(pack))
+        if labels is None:
+            fallback.extend(pack)
+            continue
+        for i, label in zip(pack, labels):
+            response_texts[i] = label
+
+    fallback_responses = (
+        engine.run([single_message_lists[i] for i in fallback]) if fallback else []
+    )
+    for i, response in zip(fallback, fallback_responses):
+        response_texts[i] = extract_response_text(response)
+
+    if cache is not None:
+        for i in pending:
+            text = response_texts[i]
+            if not isinstance(text, RequestFailure) and text != "No response":
+                row_tag = row_tags[i] if row_tags else None
+                cache.put(keys[i], engine.model, response_texts[i], row_tag)
+        cache.connection.commit()
+
+    if pending and metrics is not None:
+        metrics.add_totals(
+            "packing",
+            rows=len(pending),
+            packed_calls=len(packs),
+            fallback_rows=len(fallback),
+            tokens=total_tokens(packed_responses) + total_tokens(fallback_responses),
+        )
+    return response_texts
+
+
+# Function to print the run totals complete_packed recorded (see RunMetrics)
+def report_packing(totals):
+    if totals["rows"]:
+        print(
+            f"Packing: {totals['rows']} rows in {totals['packed_calls']} packed "
+            f"calls, {totals['fallback_rows']} rows fell back to single calls, "
+            f"{totals['tokens'] / totals['rows']:.1f} tokens per classified row"
+        )
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import csv
+import itertools
+import json
+import os
+
+from classifier.metrics import RunMetrics
+
+# Inputs and outputs with these extensions are read and written with pyarrow
+# (see classifier/columnar.py); anything else is CSV
+COLUMNAR_EXTENSIONS = (".parquet", ".pq", ".arrow", ".feather", ".ipc")
+
+# Column a labelled pool copied from an input file (see review.py) uses to
+# record the input row each of its rows came from
+SOURCE_ROW_COLUMN = "source_row_id"
+
+
+def is_columnar(path):
+    return path.lower().endswith(COLUMNAR_EXTENSIONS)
+
+
+# Function to stream rows of a CSV, Parquet or Arrow file as dicts of
+# strings. Columnar files are read in record batches holding only `columns`.
+def read_rows(path, columns):
+    if is_columnar(path):
+        from classifier.columnar import read_columnar_rows
+
+        yield from read_columnar_rows(path, columns)
+        return
+    with open(path, mode="r", encoding="utf-8", newline="") as csvfile:
+        yield from csv.DictReader(csvfile)
+
+
+def column_names(path):
+    if is_columnar(path):
+        from classifier.columnar import column_names as columnar_column_names
+
+        return columnar_column_names(path)
+    with open(path, mode="r", encoding="utf-8", newline="") as csvfile:
+        return next(csv.reader(csvfile), [])
+
+
+# Function to count the rows of an input, for progress and ETA
+def count_rows(path):
+    if is_columnar(path):
+        from classifier.columnar import count_columnar_rows
+
+        return count_columnar_rows(path)
+    with open(path, mode="r", encoding="utf-8", newline="") as csvfile:
+        # Like csv.DictReader, skip blank lines and the header
+        return max(sum(1 for row in csv.reader(csvfile) if row) - 1, 0)
+
+
+# Yield lists of up to `size` items from any iterable without materializing it
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Read a checkpoint file into {row_id: [correct, ...]}, one flag per scorer
+def load_checkpoint(checkpoint_path):
+    completed = {}
+    if not os.path.exists(checkpoint_path):
+        return completed
+    with open(checkpoint_path, mode="r", encoding="utf-8") as checkpoint_file:
+        for line in checkpoint_file:
+            row_id, *flags = line.rstrip("\n").split("\t")
+            if row_id:
+                completed[row_id] = [flag == "1" for flag in flags]
+    return completed
+
+
+# Appends classified rows to an output CSV, writing the header unless a
+# resumed run is appending to an existing file
+class CsvResultWriter:
+    def __init__(self, output_path, fieldnames, resume=False):
+        write_header = not (resume and os.path.exists(output_path))
+        self.output_file = open(
+            output_path, mode="a" if resume else "w", encoding="utf-8", newline=""
+        )
+        self.writer = csv.DictWriter(
+            self.output_file, fieldnames=fieldnames, extrasaction="ignore"
+        )
+        if write_header:
+            self.writer.writeheader()
+
+    def write_rows(self, items):
+        for item in items:
+            self.writer.writerow(item)
+        self.output_file.flush()
+
+    def close(self):
+        self.output_file.close()
+
+
+# Appends classified rows to the output (CSV, or Parquet/Arrow part files
+# chosen by the output extension) and records each finished row ID in a
+# checkpoint file. The output is flushed before the checkpoint, so after a
+# crash a row may at worst be classified twice, never lost. Rows whose request
+# failed go to a JSON-lines failures log instead and are not checkpointed, so
+# a resumed run retries them.
+class StreamingResultWriter:
+    def __init__(
+        self,
+        output_path,
+        fieldnames,
+        checkpoint_path,
+        failures_path,
+        score_columns,
+        resume=False,
+    ):
+        self.score_columns = score_columns
+        self.failure_count = 0
+        if is_columnar(output_path):
+            # pyarrow is only needed for columnar outputs, so import it on demand
+            from classifier.columnar import ColumnarResultWriter
+
+            self.output = ColumnarResultWriter(
+                output_path, fieldnames, score_columns, resume
+            )
+        else:
+            self.output = CsvResultWriter(output_path, fieldnames, resume)
+        mode = "a" if resume else "w"
+        self.checkpoint_file = open(checkpoint_path, mode=mode, encoding="utf-8")
+        self.failures_file = open(failures_path, mode=mode, encoding="utf-8")
+
+    def write_chunk(self, items):
+        self.output.write_rows(items)
+        for item in items:
+            flags = ["1" if item[column] else "0" for column in self.score_columns]
+            self.checkpoint_file.write("\t".join([item["row_id"], *flags]) + "\n")
+        self.checkpoint_file.flush()
+
+    def write_failures(self, items):
+        for item in items:
+            record = {key: item[key] for key in ("row_id", "query", "error")}
+            self.failures_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.failures_file.flush()
+        self.failure_count += len(items)
+
+    def close(self):
+        self.output.close()
+        self.checkpoint_file.close()
+        self.failures_file.close()
+
+
+# Stream rows through `generate` in chunks, appending results as they finish.
+# `generate` maps a list of rows to a list of prompts_responses items and
+# `scorers` maps each correctness column to a function comparing one item
+# against its gold label. Items carrying an "error" are logged to
+# `failures_path` and left out of the accuracy. With resume=True, rows already
+# listed in the checkpoint are skipped and count towards the final accuracy.
+# `metrics` (a RunMetrics) times each stage and records each finished chunk;
+# `generate` may time its own parsing on the same object.
+def run_pipeline(
+    rows,
+    generate,
+    scorers,
+    output_path,
+    fieldnames,
+    checkpoint_path,
+    failures_path,
+    resume=False,
+    chunk_size=100,
+    metrics=None,
+):
+    metrics = metrics or RunMetrics(progress_interval=float("inf"))
+    score_columns = list(scorers)
+    completed = load_checkpoint(checkpoint_path) if resume else {}
+    total = len(completed)
+    correct_counts = [
+        sum(flags[i] for flags in completed.values() if i < len(flags))
+        for i in range(len(score_columns))
+    ]
+    if completed:
+        print(f"Resuming: skipping {total} rows already classified")
+        metrics.record_skipped(total)
+
+    writer = StreamingResultWriter(
+        output_path, fieldnames, checkpoint_path, failures_path, score_columns, resume
+    )
+    try:
+        pending = (row for row in rows if row["row_id"] not in completed)
+        chunks = chunked(pending, chunk_size)
+        while True:
+            with metrics.stage("read"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with metrics.stage("infer"):
+                items = generate(chunk)
+            failures = [item for item in items if "error" in item]
+            items = [item for item in items if "error" not in item]
+            with metrics.stage("parse"):
+                for item in items:
+                    for i, column in enumerate(score_columns):
+                        item[column] = scorers[column](item)
+                        correct_counts[i] += item[column]
+            total += len(items)
+            with metrics.stage("write"):
+                writer.write_failures(failures)
+                writer.write_chunk(items)
+            metrics.record_chunk(items, failures)
+    finally:
+        writer.close()
+        metrics.close()
+
+    if writer.failure_count:
+        print(
+            f"{writer.failure_count} rows failed and were logged to {failures_path}; "
+            "re-run with --resume to retry them"
+        )
+
+    accuracies = {
+        column: correct / total if total else 0
+        for column, correct in zip(score_columns, correct_counts)
+    }
+    report_accuracies(accuracies)
+    return accuracies
+
+
+def report_accuracies(accuracies):
+    for column, accuracy in accuracies.items():
+        label = "" if len(accuracies) == 1 else f" ({column})"
+        print(f"Accuracy{label}: {accuracy:.2%}")
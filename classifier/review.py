@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# Active-learning review queue. Rows of a classifier output are scored by how
+# much a human look is worth: disagreement with the gold column, low answer
+# confidence and split votes. The scores go into a persistent priority queue.
+# Reviewers work through the top of the queue in CSV batches. Their
+# corrections are written into a labelled file for --few-shot and
+# --fast-path, and every cached answer for a corrected row is dropped so the
+# next run asks again.
+#
+#   python -m classifier.review push axis1 model_responses_gpt4.csv
+#   python -m classifier.review export axis1 Manualcodingoutput.csv review_batch.csv --top 50
+#   python -m classifier.review import axis1 Manualcodingoutput.csv review_batch.csv
+import argparse
+import csv
+import sqlite3
+import time
+
+from classifier.cache import ResponseCache
+from classifier.core import cache_path, load_axis
+from classifier.pipeline import SOURCE_ROW_COLUMN, column_names, read_rows
+
+queue_path = "review_queue.sqlite"
+
+# Weight of each reason in a row's review priority
+GOLD_MISMATCH_WEIGHT = 1.0
+UNCERTAINTY_WEIGHT = 0.5
+VOTE_DISAGREEMENT_WEIGHT = 0.5
+
+# Output columns used for scoring, by their single-axis names
+SCORED_COLUMNS = [
+    "classification",
+    "correct_classification",
+    "match_confidence",
+    "label_probability",
+    "vote_agreement",
+]
+
+EXPORT_FIELDNAMES = [
+    "row_id",
+    "axis",
+    "priority",
+    "reasons",
+    "query",
+    "gold",
+    "predicted",
+    "corrected",
+]
+
+
+# Function to name an output column for an axis, in the single-axis or the
+# combined naming the output file uses
+def output_column(axis, name, columns):
+    combined = f"{axis.name}_classification" in columns
+    return f"{axis.name}_{name}" if combined else name
+
+
+def as_float(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# Function to score one output row for an axis. Returns (priority, reasons).
+# Confidence is the label match confidence times the answer probability when
+# logprobs were recorded; vote agreement only exists in voting runs.
+def review_priority(row, axis, columns):
+    names = {name: output_column(axis, name, columns) for name in SCORED_COLUMNS}
+    priority, reasons = 0.0, []
+    # Columnar outputs read back booleans as "false"
+    if row.get(names["correct_classification"], "").lower() == "false":
+        priority += GOLD_MISMATCH_WEIGHT
+        reasons.append("gold mismatch")
+    confidence = as_float(row.get(names["match_confidence"]), 0.0)
+    confidence *= as_float(row.get(names["label_probability"]), 1.0)
+    if confidence < 1.0:
+        priority += UNCERTAINTY_WEIGHT * (1 - confidence)
+        reasons.append(f"confidence {confidence:.2f}")
+    agreement = as_float(row.get(names["vote_agreement"]), 1.0)
+    if agreement < 1.0:
+        priority += VOTE_DISAGREEMENT_WEIGHT * (1 - agreement)
+        reasons.append(f"vote agreement {agreement:.2f}")
+    return priority, reasons
+
+
+# Function to stream the queries of the given row IDs from the input file
+def read_queries(input_path, row_ids):
+    queries = {}
+    for row_id, row in enumerate(read_rows(input_path, ["query"])):
+        if str(row_id) in row_ids:
+            queries[str(row_id)] = row["query"]
+    return queries
+
+
+# Persistent priority queue of (row_id, axis) entries backed by SQLite, like
+# the response cache. Entries stay pending until a correction is imported;
+# re-scoring a later run updates pending entries but never reviewed ones.
+class ReviewQueue:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS review_queue (
+                row_id TEXT NOT NULL,
+                axis TEXT NOT NULL,
+                priority REAL NOT NULL,
+                reasons TEXT NOT NULL,
+                gold TEXT,
+                predicted TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                corrected TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (row_id, axis)
+            )"""
+        )
+        self.connection.execute(
+            """CREATE INDEX IF NOT EXISTS review_queue_priority
+                ON review_queue (axis, status, priority)"""
+        )
+
+    # Score every row of an output file and queue those with a reason to look
+    # at them; pending rows a later run has no reason to flag leave the queue.
+    # Returns the number of rows queued or updated.
+    def push(self, axis, output_path):
+        columns = column_names(output_path)
+        classification = output_column(axis, "classification", columns)
+        wanted = ["row_id", axis.gold_column] + [
+            output_column(axis, name, columns) for name in SCORED_COLUMNS
+        ]
+        now = time.time()
+        queued = 0
+        for row in read_rows(output_path, [name for name in wanted if name in columns]):
+            priority, reasons = review_priority(row, axis, columns)
+            if not reasons:
+                self.connection.execute(
+                    """DELETE FROM review_queue
+                        WHERE row_id = ? AND axis = ? AND status = 'pending'""",
+                    (row["row_id"], axis.name),
+                )
+                continue
+            self.connection.execute(
+                """INSERT INTO review_queue
+                    (row_id, axis, priority, reasons, gold, predicted, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (row_id, axis) DO UPDATE SET
+                        priority = excluded.priority,
+                        reasons = excluded.reasons,
+                        gold = excluded.gold,
+                        predicted = excluded.predicted,
+                        updated_at = excluded.updated_at
+                    WHERE status = 'pending'""",
+                (
+                    row["row_id"],
+                    axis.name,
+                    priority,
+                    ", ".join(reasons),
+                    row.get(axis.gold_column, "").strip(),
+                    row.get(classification, ""),
+                    now,
+                ),
+            )
+            queued += 1
+        self.connection.commit()
+        return queued
+
+    # The `count` pending entries of an axis with the highest priority
+    def top(self, axis, count):
+        return self.connection.execute(
+            """SELECT row_id, priority, reasons, gold, predicted FROM review_queue
+                WHERE axis = ? AND status = 'pending'
+                ORDER BY priority DESC, CAST(row_id AS INTEGER) LIMIT ?""",
+            (axis.name, count),
+        ).fetchall()
+
+    def record_correction(self, row_id, axis, code):
+        self.connection.execute(
+            """UPDATE review_queue SET status = 'reviewed', corrected = ?,
+                updated_at = ? WHERE row_id = ? AND axis = ?""",
+            (code, time.time(), row_id, axis.name),
+        )
+
+    # {axis name: {row_id: corrected code}} for every reviewed entry
+    def corrections(self):
+        corrections = {}
+        for axis_name, row_id, code in self.connection.execute(
+            """SELECT axis, row_id, corrected FROM review_queue
+                WHERE status = 'reviewed'"""
+        ):
+            corrections.setdefault(axis_name, {})[row_id] = code
+        return corrections
+
+    def report(self, axis):
+        counts = dict(
+            self.connection.execute(
+                """SELECT status, COUNT(*) FROM review_queue WHERE axis = ?
+                    GROUP BY status""",
+                (axis.name,),
+            )
+        )
+        print(
+            f"Review queue ({axis.name}): {counts.get('pending', 0)} pending, "
+            f"{counts.get('reviewed', 0)} reviewed"
+        )
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+# Function to write the top of the queue as a CSV batch for reviewers, who
+# fill in `corrected` with a label name or code for each row they decide
+def export_batch(queue, axis, input_path, batch_path, count):
+    entries = queue.top(axis, count)
+    queries = read_queries(input_path, {entry[0] for entry in entries})
+    with open(batch_path, mode="w", encoding="utf-8", newline="") as batch_file:
+        writer = csv.DictWriter(batch_file, fieldnames=EXPORT_FIELDNAMES)
+        writer.writeheader()
+        for row_id, priority, reasons, gold, predicted in entries:
+            writer.writerow(
+                {
+                    "row_id": row_id,
+                    "axis": axis.name,
+                    "priority": f"{priority:.3f}",
+                    "reasons": reasons,
+                    "query": queries.get(row_id, ""),
+                    "gold": gold,
+                    "predicted": predicted,
+                    "corrected": "",
+                }
+            )
+    print(f"Exported {len(entries)} rows for review to {batch_path}")
+
+
+# Function to read a reviewed batch into the queue. Returns {row_id: code} for
+# the rows corrected in this batch; rows left blank stay pending.
+def import_batch(queue, axis, batch_path):
+    corrected = {}
+    with open(batch_path, mode="r", encoding="utf-8", newline="") as batch_file:
+        for row in csv.DictReader(batch_file):
+            value = row["corrected"].strip()
+            if not value or row.get("axis", axis.name) != axis.name:
+                continue
+            code = value if value in axis.labels.values() else None
+            code = code or axis.theme_text_to_number(value)
+            if code == "0":
+                print(f"Row {row['row_id']}: {value!r} is not an {axis.name} label")
+                continue
+            queue.record_correction(row["row_id"], axis, code)
+            corrected[row["row_id"]] = code
+    queue.connection.commit()
+    return corrected
+
+
+# Function to write the input rows with every reviewed correction of every
+# axis in the queue applied to that axis's gold column: the example pool for
+# --few-shot and --fast-path
+def write_labelled_pool(queue, input_path, labelled_path):
+    corrections = {
+        load_axis(axis_name).gold_column: axis_corrections
+        for axis_name, axis_corrections in queue.corrections().items()
+    }
+    columns = column_names(input_path)
+    # Each row records the input row it came from, which leave-one-out
+    # evaluation on the pool uses as its row ID
+    fieldnames = columns
+    if SOURCE_ROW_COLUMN not in columns:
+        fieldnames = columns + [SOURCE_ROW_COLUMN]
+    with open(labelled_path, mode="w", encoding="utf-8", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        for row_id, row in enumerate(read_rows(input_path, columns)):
+            for gold_column, axis_corrections in corrections.items():
+                if str(row_id) in axis_corrections:
+                    row[gold_column] = axis_corrections[str(row_id)]
+            row.setdefault(SOURCE_ROW_COLUMN, str(row_id))
+            writer.writerow(row)
+    counts = ", ".join(
+        f"{len(axis_corrections)} {gold_column!r}"
+        for gold_column, axis_corrections in corrections.items()
+    )
+    print(f"Wrote {labelled_path} with corrected labels: {counts or 'none'}")
+
+
+# Function to drop every cached answer for the corrected rows, whatever the
+# prompt, output mode or sample it was cached under
+def invalidate_corrected(input_path, row_ids, path=cache_path):
+    queries = read_queries(input_path, set(row_ids))
+    cache = ResponseCache(path)
+    removed = cache.invalidate_rows(map(ResponseCache.row_tag, queries.values()))
+    cache.close()
+    print(f"Removed {removed} cached answers for {len(queries)} corrected rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Active-learning review queue")
+    parser.add_argument("--queue", default=queue_path, help="review queue database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    push = commands.add_parser("push", help="score an output file into the queue")
+    export = commands.add_parser("export", help="write the top rows for review")
+    review = commands.add_parser("import", help="read a reviewed batch")
+    push.add_argument("axis", help="axis name, e.g. axis1")
+    push.add_argument("output", help="classifier output file")
+    for command in (export, review):
+        command.add_argument("axis", help="axis name, e.g. axis1")
+        command.add_argument("input", help="the classified input file")
+    export.add_argument("batch", help="CSV batch to write")
+    export.add_argument("--top", type=int, default=50, help="rows per batch")
+    review.add_argument("batch", help="reviewed CSV batch")
+    review.add_argument(
+        "--labelled",
+        default="labelled_corrected.csv",
+        help="corrected example pool to write",
+    )
+    review.add_argument(
+        "--keep-cache", action="store_true", help="keep cached answers"
+    )
+    args = parser.parse_args()
+
+    axis = load_axis(args.axis)
+    queue = ReviewQueue(args.queue)
+    if args.command == "push":
+        queued = queue.push(axis, args.output)
+        print(f"Scored {args.output}: {queued} rows queued or updated")
+    elif args.command == "export":
+        export_batch(queue, axis, args.input, args.batch, args.top)
+    else:
+        corrected = import_batch(queue, axis, args.batch)
+        print(f"Imported {len(corrected)} corrections from {args.batch}")
+        write_labelled_pool(queue, args.input, args.labelled)
+        if corrected and not args.keep_cache:
+            invalidate_corrected(args.input, corrected)
+    queue.report(axis)
+    queue.close()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Session-aware incremental classification of raw conversation logs. A log
+# has one row per turn: session_id, turn (its number within the session),
+# query and response. Each turn with a previous turn becomes a Q1/R/Q2 row:
+# the previous query, the engine's response to it and this turn's query.
+# A state database keeps every ingested turn and, per axis, the (session,
+# turn) pairs already classified. A daily run on the new log file therefore
+# only classifies newly appended turns, including a first new turn whose
+# previous turn came in an earlier file.
+#
+#   python -m classifier.sessions axis1 logs/2026-10-18.csv sessions_2026-10-18.csv
+#   python -m classifier.sessions axis1,axis2 logs/2026-10-18.parquet combined.csv
+import collections
+import os
+import sqlite3
+import time
+
+import dotenv
+
+from classifier.core import (
+    build_arg_parser,
+    check_args,
+    classify_prompts,
+    load_axis,
+    prompt_from_row,
+)
+from classifier.excerpts import Excerpt, format_excerpt
+from classifier.pipeline import column_names, load_checkpoint, read_rows
+
+state_path = "session_state.sqlite"
+
+SESSION_COLUMNS = ["session_id", "turn", "query", "response"]
+
+
+# Row IDs name the turn a row classifies, the second query of its triple
+def session_row_id(session_id, turn):
+    return f"{session_id}:{turn}"
+
+
+def parse_row_id(row_id):
+    session_id, _, turn = row_id.rpartition(":")
+    return session_id, int(turn)
+
+
+# Ingested turns and classified (session, turn, axis) entries, stored in
+# SQLite like the response cache. Lookups are by primary key, so a run costs
+# the same however much history is stored.
+class SessionStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS turns (
+                session_id TEXT NOT NULL,
+                turn INTEGER NOT NULL,
+                query TEXT NOT NULL,
+                response TEXT NOT NULL,
+                ingested_at REAL NOT NULL,
+                PRIMARY KEY (session_id, turn)
+            )"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS classified (
+                session_id TEXT NOT NULL,
+                turn INTEGER NOT NULL,
+                axis TEXT NOT NULL,
+                output TEXT NOT NULL,
+                classified_at REAL NOT NULL,
+                PRIMARY KEY (session_id, turn, axis)
+            )"""
+        )
+
+    def stored_turn(self, session_id, turn):
+        return self.connection.execute(
+            "SELECT query, response FROM turns WHERE session_id = ? AND turn = ?",
+            (session_id, turn),
+        ).fetchone()
+
+    def add_turns(self, turns):
+        now = time.time()
+        self.connection.executemany(
+            """INSERT OR REPLACE INTO turns
+                (session_id, turn, query, response, ingested_at)
+                VALUES (?, ?, ?, ?, ?)""",
+            [(*turn, now) for turn in turns],
+        )
+        self.connection.commit()
+
+    # True if the turn has been classified on every one of the axes
+    def is_classified(self, session_id, turn, axes):
+        (count,) = self.connection.execute(
+            f"""SELECT COUNT(*) FROM classified
+                WHERE session_id = ? AND turn = ?
+                AND axis IN ({", ".join("?" * len(axes))})""",
+            (session_id, turn, *(axis.name for axis in axes)),
+        ).fetchone()
+        return count == len(axes)
+
+    def mark_classified(self, row_ids, axes, output_path):
+        now = time.time()
+        self.connection.executemany(
+            """INSERT OR REPLACE INTO classified
+                (session_id, turn, axis, output, classified_at)
+                VALUES (?, ?, ?, ?, ?)""",
+            [
+                (*parse_row_id(row_id), axis.name, output_path, now)
+                for row_id in row_ids
+                for axis in axes
+            ],
+        )
+        self.connection.commit()
+
+    def report(self, axes):
+        for axis in axes:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM classified WHERE axis = ?", (axis.name,)
+            ).fetchone()
+            print(f"Sessions ({axis.name}): {count} turns classified so far")
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+# Function to read a log file into {session_id: {turn: row}}. One file holds
+# one increment of traffic, so it is grouped in memory; turns of a session may
+# be interleaved with other sessions and out of order. Gold columns are kept
+# when the log has them, e.g. for a labelled sample.
+def read_session_log(log_path, axes):
+    available = column_names(log_path)
+    missing = [name for name in SESSION_COLUMNS if name not in available]
+    if missing:
+        raise ValueError(f"{log_path} has no {', '.join(missing)} column")
+    gold_columns = [
+        axis.gold_column for axis in axes if axis.gold_column in available
+    ]
+    sessions = collections.defaultdict(dict)
+    for row in read_rows(log_path, SESSION_COLUMNS + gold_columns):
+        try:
+            turn = int(row["turn"])
+        except ValueError:
+            raise ValueError(
+                f"{log_path}: turn {row['turn']!r} of session "
+                f"{row['session_id']!r} is not a number"
+            ) from None
+        sessions[row["session_id"]][turn] = row
+    return sessions
+
+
+# Function to build the prompts for the turns of a log file that are not yet
+# classified on every axis. A turn's previous turn is looked up in the same
+# file first, then in the turns stored by earlier runs; the first turn of a
+# session has none and is not classified. Returns (prompts, skipped count).
+def pending_prompts(store, sessions, axes):
+    prompts = []
+    skipped = 0
+    for session_id, turns in sessions.items():
+        for turn in sorted(turns):
+            row = turns[turn]
+            previous = turns.get(turn - 1)
+            if previous is not None:
+                previous = (previous["query"], previous["response"])
+            else:
+                previous = store.stored_turn(session_id, turn - 1)
+            if previous is None:
+                continue
+            if store.is_classified(session_id, turn, axes):
+                skipped += 1
+                continue
+            excerpt = Excerpt(previous[0], previous[1], row["query"])
+            triple = {"query": format_excerpt(excerpt, excerpt.response)}
+            for axis in axes:
+                triple[axis.gold_column] = row.get(axis.gold_column, "")
+            prompts.append(
+                prompt_from_row(session_row_id(session_id, turn), triple, axes)
+            )
+    return prompts, skipped
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser()
+    parser.description = "Classify the new turns of a session log"
+    parser.add_argument("axes", help="comma-separated axis names, e.g. axis1,axis2")
+    parser.add_argument("log", help="session log (CSV, Parquet, Arrow)")
+    parser.add_argument("output", help="output file for this increment")
+    parser.add_argument("--state", default=state_path, help="session state database")
+    parser.add_argument("--model", default="gpt-4-0125-preview")
+    args = parser.parse_args()
+    axes = [load_axis(name) for name in args.axes.split(",")]
+    check_args(parser, args, axes)
+    if args.shards > 1:
+        parser.error("--shards needs a CSV input with row offsets, not a session log")
+
+    dotenv.load_dotenv()
+    store = SessionStore(args.state)
+    try:
+        sessions = read_session_log(args.log, axes)
+    except ValueError as error:
+        parser.error(str(error))
+    prompts, skipped = pending_prompts(store, sessions, axes)
+    print(
+        f"Ingested {sum(map(len, sessions.values()))} turns of {len(sessions)} "
+        f"sessions: {len(prompts)} to classify, {skipped} already classified"
+    )
+    # Stored before classifying, so the next file can pair its first turns
+    # with these even if this run is interrupted
+    store.add_turns(
+        (session_id, turn, row["query"], row["response"])
+        for session_id, turns in sessions.items()
+        for turn, row in turns.items()
+    )
+    if prompts:
+        # Always append: a re-run over the same log retries only the pending
+        # turns and must keep the rows earlier runs wrote to this output
+        args.resume = True
+        _, usage = classify_prompts(
+            prompts,
+            axes,
+            args.log,
+            args.output,
+            args.model,
+            os.getenv("OPENAI_API_KEY"),
+            args,
+            total_rows=len(prompts),
+        )
+        # Checkpointed rows were written; failed rows stay pending for the
+        # next run over this file
+        completed = load_checkpoint(f"{args.output}.checkpoint")
+        store.mark_classified(
+            [prompt["row_id"] for prompt in prompts if prompt["row_id"] in completed],
+            axes,
+            args.output,
+        )
+        usage.report()
+    store.report(axes)
+    store.close()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import csv
+import heapq
+import io
+import itertools
+import os
+
+from classifier.pipeline import report_accuracies
+
+
+# Function to split a CSV file into up to `count` shards of roughly equal byte
+# size, cut only at record boundaries. Quoted fields may span lines, so a line
+# ends a record only when the quotes seen so far are balanced. Returns one
+# (byte offset, first row ID, row count) tuple per non-empty shard; row IDs
+# are the same record indices read_prompts assigns.
+def find_shards(path, count):
+    size = os.path.getsize(path)
+    shards = []
+    position = 0
+    in_quotes = False
+    header_read = False
+    rows = 0
+    start, start_row = 0, 0
+    with open(path, mode="rb") as csvfile:
+        for line in csvfile:
+            position += len(line)
+            # The csv module skips blank lines between records
+            if not in_quotes and not line.strip(b"\r\n"):
+                continue
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if in_quotes:
+                continue
+            if not header_read:
+                header_read = True
+                start = position
+                continue
+            rows += 1
+            cut = size * (len(shards) + 1) // count
+            if len(shards) < count - 1 and position >= cut:
+                shards.append((start, start_row, rows - start_row))
+                start, start_row = position, rows
+    if rows > start_row:
+        shards.append((start, start_row, rows - start_row))
+    return shards
+
+
+# Function to stream (row_id, row) pairs of one shard found by find_shards
+def read_csv_shard(path, offset, first_row_id, row_count):
+    with open(path, mode="r", encoding="utf-8", newline="") as csvfile:
+        fieldnames = next(csv.reader(csvfile))
+    with open(path, mode="rb") as raw_file:
+        raw_file.seek(offset)
+        csvfile = io.TextIOWrapper(raw_file, encoding="utf-8", newline="")
+        reader = csv.DictReader(csvfile, fieldnames=fieldnames)
+        for i, row in enumerate(itertools.islice(reader, row_count)):
+            yield str(first_row_id + i), row
+
+
+def shard_output_path(output_path, index):
+    stem, extension = os.path.splitext(output_path)
+    return f"{stem}.shard{index}{extension}"
+
+
+# Function to yield a shard output's rows that are in row ID order. Rows a
+# resumed run appended after higher row IDs go to `stragglers` instead.
+def ordered_rows(path, stragglers):
+    with open(path, mode="r", encoding="utf-8", newline="") as csvfile:
+        highest = -1
+        for row in csv.DictReader(csvfile):
+            row_id = int(row["row_id"])
+            if row_id < highest:
+                stragglers.append(row)
+                continue
+            highest = row_id
+            yield row
+
+
+# Merge the per-shard output files into one output in input order and compute
+# the accuracy over all of them. Each shard file is already almost sorted, so
+# the shards are merged in a streaming k-way merge; only rows that --resume
+# appended out of order are held in memory. A row written twice after a crash
+# is kept once.
+def merge_shards(shard_paths, output_path, score_columns):
+    stragglers = []
+    for path in shard_paths:
+        for _ in ordered_rows(path, stragglers):
+            pass
+    stragglers.sort(key=lambda row: int(row["row_id"]))
+    streams = [ordered_rows(path, []) for path in shard_paths] + [iter(stragglers)]
+
+    with open(shard_paths[0], mode="r", encoding="utf-8", newline="") as csvfile:
+        fieldnames = next(csv.reader(csvfile))
+    total = 0
+    correct_counts = dict.fromkeys(score_columns, 0)
+    with open(output_path, mode="w", encoding="utf-8", newline="") as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+        writer.writeheader()
+        previous = None
+        for row in heapq.merge(*streams, key=lambda row: int(row["row_id"])):
+            if row["row_id"] == previous:
+                continue
+            previous = row["row_id"]
+            writer.writerow(row)
+            total += 1
+            for column in score_columns:
+                correct_counts[column] += row[column] == "True"
+
+    accuracies = {
+        column: correct / total if total else 0
+        for column, correct in correct_counts.items()
+    }
+    report_accuracies(accuracies)
+    return accuracies
+
+
+# Classify a CSV file in `count` worker processes. `worker` is called in each
+# process as worker(shard_index, shard, *worker_args), with shard being the
+# (offset, first_row_id, row_count) tuple to pass to read_csv_shard; it must
+# write shard_output_path(output_path, shard_index). Returns the workers'
+# results in shard order.
+def run_sharded(input_path, output_path, count, score_columns, worker, *worker_args):
+    shards = find_shards(input_path, count)
+    print(f"Sharding {input_path} into {len(shards)} shards")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [
+            pool.submit(worker, index, shard, *worker_args)
+            for index, shard in enumerate(shards)
+        ]
+        results = [future.result() for future in futures]
+    merge_shards(
+        [shard_output_path(output_path, index) for index in range(len(shards))],
+        output_path,
+        score_columns,
+    )
+    return results
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import re
+
+# How the model is asked to answer:
+#   text   - free text, matched to a label afterwards (the original behaviour)
+#   schema - a JSON object whose values are restricted to each axis's labels,
+#            given as the arguments of a forced call to a strict function
+#   code   - only the label's number from the prompt list, in a few tokens
+OUTPUT_MODES = ("text", "schema", "code")
+
+# Appended to the system prompt in code mode
+CODE_INSTRUCTIONS = """
+
+Reply only with the number of the chosen label as listed above, and nothing else."""
+
+COMBINED_CODE_INSTRUCTIONS = """
+
+For each axis, answer with the number of the chosen label as listed in that axis's instructions instead of its name, for example {example}."""
+
+
+# Name of the function schema mode forces the model to call
+LABEL_TOOL_NAME = "classification"
+
+
+# Strict function definition whose arguments hold one property per axis,
+# limited to its label names. A strict function is used rather than a JSON
+# schema response_format, which only the newest models accept; function
+# calling works with the gpt-4 models the scripts default to.
+def label_tool(axes):
+    return {
+        "type": "function",
+        "function": {
+            "name": LABEL_TOOL_NAME,
+            "description": "Record the chosen label for each axis.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    axis.name: {"type": "string", "enum": list(axis.labels)}
+                    for axis in axes
+                },
+                "required": [axis.name for axis in axes],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+# Function to add the mode's answer instructions to the system prompt
+def output_mode_system_prompt(system_prompt, axes, output_mode):
+    if output_mode != "code":
+        return system_prompt
+    if len(axes) == 1:
+        return system_prompt + CODE_INSTRUCTIONS
+    example = "{" + ", ".join(f'"{axis.name}": 1' for axis in axes) + "}"
+    return system_prompt + COMBINED_CODE_INSTRUCTIONS.format(example=example)
+
+
+# Function to get the extra request parameters for an output mode. Constrained
+# modes decode greedily; code mode also caps the answer at a few tokens.
+def output_mode_request_kwargs(axes, output_mode, logprobs=False):
+    request_kwargs = {}
+    if output_mode == "schema":
+        request_kwargs.update(
+            tools=[label_tool(axes)],
+            tool_choice={"type": "function", "function": {"name": LABEL_TOOL_NAME}},
+            parallel_tool_calls=False,
+            temperature=0,
+        )
+    elif output_mode == "code":
+        max_tokens = 3 if len(axes) == 1 else 8 * len(axes) + 4
+        request_kwargs.update(max_tokens=max_tokens, temperature=0)
+    if logprobs:
+        request_kwargs["logprobs"] = True
+    return request_kwargs
+
+
+# Function to write a few-shot example's answer the way this output mode asks
+# the model to answer. `labels` maps each axis name to a label.
+def example_answer(labels, axes, output_mode):
+    if output_mode == "code":
+        numbers = {
+            axis.name: int(axis.matcher.label_numbers[labels[axis.name]])
+            for axis in axes
+        }
+        if len(axes) == 1:
+            return str(numbers[axes[0].name])
+        return json.dumps(numbers)
+    if len(axes) == 1 and output_mode == "text":
+        return labels[axes[0].name]
+    return json.dumps(
+        {axis.name: labels[axis.name] for axis in axes}, ensure_ascii=False
+    )
+
+
+# Function to turn the answer's token logprobs into one probability per axis:
+# the product of the probabilities of the tokens that spell that axis's value
+# (the whole answer for a single-axis reply that is not JSON). Returns {} when
+# the text carries no logprobs.
+def answer_probabilities(response_text, axes):
+    token_logprobs = getattr(response_text, "token_logprobs", None)
+    if not token_logprobs:
+        return {}
+    answer = "".join(token for token, _ in token_logprobs)
+    probabilities = {}
+    for axis in axes:
+        value = re.search(
+            rf'"{re.escape(axis.name)}"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)', answer
+        )
+        if value:
+            start, end = value.span(1)
+        elif len(axes) == 1:
+            start, end = 0, len(answer)
+        else:
+            continue
+        position, total = 0, 0.0
+        for token, logprob in token_logprobs:
+            if position < end and position + len(token) > start:
+                total += logprob
+            position += len(token)
+        probabilities[axis.name] = math.exp(total)
+    return probabilities
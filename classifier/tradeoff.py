@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Accuracy against prompt size for each response compression setting of an
+# axis. Every setting classifies the same labelled rows; answers go through
+# the response cache, so settings that leave a row's message unchanged do not
+# call the API again.
+#
+#   python -m classifier.tradeoff axis2 Manualcodingoutput.csv --limit 500 \
+#       --settings none,head:100,sentences:100,drop
+import argparse
+import itertools
+import json
+
+import dotenv
+
+from classifier.cache import ResponseCache
+from classifier.core import (
+    build_messages,
+    build_system_prompt,
+    cache_path,
+    classification_column,
+    generate_responses,
+    is_correct_classification,
+    load_axis,
+    make_engine,
+    read_prompts,
+)
+from classifier.engine import estimate_message_tokens, estimate_tokens
+from classifier.excerpts import parse_compression
+
+DEFAULT_SETTINGS = "none,head-tail:200,sentences:200,head:100,sentences:100,drop"
+
+
+# Function to classify `prompts` once per setting and return one result per
+# setting: estimated user-message and total prompt tokens per row, accuracy
+# and the share of answers that matched no label
+def compare_settings(axis, prompts, settings, engine, cache=None):
+    system_prompt = build_system_prompt([axis])
+    results = []
+    for setting in settings:
+        # A fresh compressor per pass keeps the token counts separate
+        queries = [parse_compression(setting).request_text(p) for p in prompts]
+        message_tokens = sum(
+            estimate_message_tokens(build_messages(system_prompt, query))
+            for query in queries
+        )
+        items = generate_responses(
+            prompts, [axis], engine, cache, compressor=parse_compression(setting)
+        )
+        items = [item for item in items if "error" not in item]
+        correct = sum(is_correct_classification(item, axis, [axis]) for item in items)
+        column = classification_column(axis, [axis])
+        unparsed = sum(not item[column] for item in items)
+        results.append(
+            {
+                "setting": setting,
+                "rows": len(items),
+                "query_tokens": sum(map(estimate_tokens, queries)) / len(prompts),
+                "prompt_tokens": message_tokens / len(prompts),
+                "accuracy": correct / len(items) if items else 0.0,
+                "unparsed": unparsed / len(items) if items else 0.0,
+            }
+        )
+    return results
+
+
+def print_tradeoff(results):
+    baseline = results[0]
+    print("setting           query tok/row  prompt tok/row  saved   accuracy  delta")
+    for result in results:
+        saved = 1 - result["prompt_tokens"] / baseline["prompt_tokens"]
+        delta = result["accuracy"] - baseline["accuracy"]
+        print(
+            f"{result['setting']:<16}  {result['query_tokens']:13.1f}  "
+            f"{result['prompt_tokens']:14.1f}  {saved:6.2%}  "
+            f"{result['accuracy']:8.2%}  {delta:+.2%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare response compression settings for one axis"
+    )
+    parser.add_argument("axis", help="axis name, e.g. axis1")
+    parser.add_argument("labelled", help="input file with query and gold columns")
+    parser.add_argument(
+        "--settings",
+        default=DEFAULT_SETTINGS,
+        help="comma-separated settings; deltas are against the first",
+    )
+    parser.add_argument("--limit", type=int, default=500, help="rows to classify")
+    parser.add_argument("--model", default="gpt-4-0125-preview")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    settings = args.settings.split(",")
+    try:
+        for setting in settings:
+            parse_compression(setting)
+    except ValueError as error:
+        parser.error(str(error))
+
+    dotenv.load_dotenv()
+    axis = load_axis(args.axis)
+    prompts = list(itertools.islice(read_prompts(args.labelled, [axis]), args.limit))
+    cache = None if args.no_cache else ResponseCache(cache_path)
+    engine = make_engine(args.model, concurrency=args.concurrency)
+    results = compare_settings(axis, prompts, settings, engine, cache)
+    print_tradeoff(results)
+    engine.usage.report()
+    if cache is not None:
+        cache.close()
+    if args.json:
+        with open(args.json, mode="w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import math
+
+# USD per million tokens: (input, cached input, output). Cached input is None
+# for models without prompt caching. Update when prices change; models are
+# matched on the longest listed prefix.
+MODEL_PRICES = {
+    "gpt-4-0125-preview": (10.00, None, 30.00),
+    "gpt-4-turbo": (10.00, None, 30.00),
+    "gpt-4": (30.00, None, 60.00),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+# The Batch API bills at half price
+BATCH_DISCOUNT = 0.5
+
+
+def model_prices(model):
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# Per-call token usage and latency, captured from each response object.
+# Prompt-cache hits are the `cached_tokens` the API reports for the static
+# prompt prefix it did not have to process again.
+class UsageTracker:
+    def __init__(self, model, discount=1.0):
+        self.model = model
+        self.discount = discount
+        self.prompt_tokens = []
+        self.cached_tokens = []
+        self.completion_tokens = []
+        self.latencies = []
+
+    # Latency is None for calls whose timing is not known (Batch API results)
+    def record(self, response, latency=None):
+        usage = response.usage
+        if usage is None:
+            return
+        details = usage.prompt_tokens_details
+        self.prompt_tokens.append(usage.prompt_tokens)
+        self.cached_tokens.append((details.cached_tokens or 0) if details else 0)
+        self.completion_tokens.append(usage.completion_tokens)
+        if latency is not None:
+            self.latencies.append(latency)
+
+    # Add the calls recorded by another tracker, e.g. from a shard worker
+    def extend(self, other):
+        self.prompt_tokens += other.prompt_tokens
+        self.cached_tokens += other.cached_tokens
+        self.completion_tokens += other.completion_tokens
+        self.latencies += other.latencies
+
+    def cost(self):
+        prices = model_prices(self.model)
+        if prices is None:
+            return None
+        input_price, cached_price, output_price = prices
+        cached = sum(self.cached_tokens)
+        uncached = sum(self.prompt_tokens) - cached
+        if cached_price is None:
+            cached_price = input_price
+        dollars = (
+            uncached * input_price
+            + cached * cached_price
+            + sum(self.completion_tokens) * output_price
+        ) / 1e6
+        return dollars * self.discount
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        prompt_tokens = sum(self.prompt_tokens)
+        return {
+            "calls": len(self.prompt_tokens),
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": sum(self.cached_tokens),
+            "completion_tokens": sum(self.completion_tokens),
+            "prompt_cache_hit_ratio": (
+                sum(self.cached_tokens) / prompt_tokens if prompt_tokens else 0.0
+            ),
+            "cost_usd": self.cost(),
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_p99": percentile(latencies, 0.99),
+        }
+
+    def report(self):
+        summary = self.summary()
+        if not summary["calls"]:
+            return
+        calls = summary["calls"]
+        tokens = summary["prompt_tokens"] + summary["completion_tokens"]
+        print(
+            f"Usage: {calls} calls, {summary['prompt_tokens']} prompt tokens "
+            f"({summary['cached_tokens']} cached, "
+            f"{summary['prompt_cache_hit_ratio']:.2%} prompt cache hits), "
+            f"{summary['completion_tokens']} completion tokens, "
+            f"{tokens / calls:.1f} tokens per call"
+        )
+        cost = summary["cost_usd"]
+        if cost is None:
+            print(f"Cost: no price listed for {self.model} in MODEL_PRICES")
+        else:
+            print(f"Cost: ${cost:.4f}")
+        if self.latencies:
+            print(
+                f"Latency: p50 {summary['latency_p50']:.2f}s, "
+                f"p95 {summary['latency_p95']:.2f}s, "
+                f"p99 {summary['latency_p99']:.2f}s"
+            )
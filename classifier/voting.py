@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+
+from classifier.cache import complete_with_cache
+from classifier.engine import RequestFailure
+
+
+# Winning answer of a vote, carrying the per-axis vote counts and the number
+# of samples taken for the row
+class VotedText(str):
+    def __new__(cls, text, votes, samples):
+        voted = super().__new__(cls, text)
+        voted.votes = votes
+        voted.samples = samples
+        return voted
+
+
+# Self-consistency voting: each row is sampled up to `max_samples` times and
+# every axis takes its majority label. Sampling stops early for a row once
+# every axis is decided, i.e. its leading label can no longer be overtaken by
+# the remaining samples, so the result is always the plain N-sample majority.
+# Unanimous rows therefore cost a bare majority of N calls and only contested
+# rows cost `max_samples`. With `min_agreement` set, an axis also counts as
+# decided once its first `min_agreement` samples all agree; this is cheaper
+# but can stop on a lead the remaining samples would have overturned.
+class SelfConsistencyVoter:
+    def __init__(self, max_samples=5, min_agreement=0):
+        self.max_samples = max_samples
+        self.min_agreement = min(max(min_agreement, 0), max_samples)
+        self.rows = 0
+        self.calls = 0
+        self.voted_rows = 0
+        self.agreement_total = 0.0
+
+    def _decided(self, counts, samples):
+        ranked = counts.most_common(2)
+        if not ranked:
+            return False
+        leader = ranked[0][1]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if leader - runner_up > self.max_samples - samples:
+            return True
+        if not self.min_agreement:
+            return False
+        return samples >= self.min_agreement and leader == samples
+
+    # Samples needed before a row can be decided: a bare majority of
+    # `max_samples`, or `min_agreement` with the agreement shortcut
+    def first_round_size(self):
+        if self.min_agreement:
+            return self.min_agreement
+        return self.max_samples // 2 + 1
+
+    # Sample the message lists in rounds: the first round takes
+    # first_round_size() samples per row, later rounds one more for each
+    # undecided row. `parse`
+    # maps an answer to {axis name: label or None}. Returns one VotedText per
+    # row, or the last answer if some axis got no usable vote.
+    def complete(self, engine, message_lists, axes, parse, cache=None, row_tags=None):
+        votes = [
+            {axis.name: collections.Counter() for axis in axes} for _ in message_lists
+        ]
+        samples = [0] * len(message_lists)
+        last_texts = [None] * len(message_lists)
+        pending = list(range(len(message_lists)))
+        round_size = self.first_round_size()
+        while pending:
+            requests = [(i, samples[i] + k) for i in pending for k in range(round_size)]
+            texts = complete_with_cache(
+                engine,
+                [message_lists[i] for i, _ in requests],
+                cache,
+                samples=[sample for _, sample in requests],
+                row_tags=[row_tags[i] for i, _ in requests] if row_tags else None,
+            )
+            for (i, _), text in zip(requests, texts):
+                samples[i] += 1
+                if last_texts[i] is None or not isinstance(text, RequestFailure):
+                    last_texts[i] = text
+                if isinstance(text, RequestFailure):
+                    continue
+                for axis_name, label in parse(text).items():
+                    if label is not None:
+                        votes[i][axis_name][label] += 1
+            self.calls += len(requests)
+            pending = [
+                i
+                for i in pending
+                if samples[i] < self.max_samples
+                and not all(
+                    self._decided(votes[i][axis.name], samples[i]) for axis in axes
+                )
+            ]
+            round_size = 1
+
+        results = []
+        for i in range(len(message_lists)):
+            winners = {
+                axis.name: votes[i][axis.name].most_common(1)[0][0]
+                for axis in axes
+                if votes[i][axis.name]
+            }
+            self.rows += 1
+            if len(winners) < len(axes):
+                # No usable vote on some axis: keep the last answer as it was
+                results.append(last_texts[i])
+                continue
+            self.voted_rows += 1
+            self.agreement_total += agreement(votes[i], samples[i])
+            if len(axes) == 1:
+                text = winners[axes[0].name]
+            else:
+                text = json.dumps(winners, ensure_ascii=False)
+            counts = {name: dict(counter) for name, counter in votes[i].items()}
+            results.append(VotedText(text, counts, samples[i]))
+        return results
+
+    def report(self):
+        if not self.rows:
+            return
+        plain_calls = self.rows * self.max_samples
+        saved = 1 - self.calls / plain_calls
+        mean_agreement = self.agreement_total / max(self.voted_rows, 1)
+        rule = "an unbeatable lead"
+        if self.min_agreement:
+            rule += f" or {self.min_agreement} agreeing samples (shortcut)"
+        print(
+            f"Voting: {self.calls} samples for {self.rows} rows "
+            f"({self.calls / self.rows:.2f} per row) against {plain_calls} for plain "
+            f"{self.max_samples}x sampling ({saved:.2%} saved), stopping on "
+            f"{rule}, mean agreement {mean_agreement:.3f}"
+        )
+
+
+# Share of a row's samples that voted for the winning label, averaged over axes
+def agreement(votes, samples):
+    if not samples:
+        return 0.0
+    shares = [
+        counter.most_common(1)[0][1] / samples for counter in votes.values() if counter
+    ]
+    return sum(shares) / len(shares) if shares else 0.0
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Retry, Retry-After and circuit breaker behaviour of the engine against the
+# local mock server replaying scripted errors. Run with
+#   python -m unittest discover tests
+import contextlib
+import io
+import time
+import unittest
+
+from classifier.engine import AsyncClassificationEngine, RequestFailure
+from classifier.mock_server import start_mock_server
+
+MESSAGES = [{"role": "user", "content": "Q1: a\nR: b\nQ2: c"}]
+
+
+class ScriptedErrorsTest(unittest.TestCase):
+    def start_engine(self, script, retry_after=None, **options):
+        server = start_mock_server(
+            script=script, retry_after=retry_after, reply="Narrowing Down"
+        )
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address
+        # One request at a time, so the script is consumed in row order
+        return AsyncClassificationEngine(
+            "gpt-4-0125-preview",
+            concurrency=1,
+            api_key="test",
+            base_url=f"http://{host}:{port}/v1",
+            base_backoff=0.01,
+            max_backoff=0.05,
+            **options,
+        )
+
+    def test_retries_honour_retry_after(self):
+        engine = self.start_engine((429, 500), retry_after=0.5)
+        started = time.monotonic()
+        (response,) = engine.run([MESSAGES])
+        elapsed = time.monotonic() - started
+        self.assertNotIsInstance(response, RequestFailure)
+        self.assertEqual(response.choices[0].message.content, "Narrowing Down")
+        self.assertEqual(engine.retries, 2)
+        self.assertEqual(engine.failures, 0)
+        # The 429 asked for 0.5s, far above the jittered backoff
+        self.assertGreaterEqual(elapsed, 0.5)
+
+    def test_breaker_opens_and_non_retryable_row_fails(self):
+        engine = self.start_engine(
+            (429, 500, 400),
+            retry_after=0.1,
+            breaker_threshold=2,
+            breaker_cooldown=0.5,
+        )
+        output = io.StringIO()
+        started = time.monotonic()
+        with contextlib.redirect_stdout(output):
+            first, second = engine.run([MESSAGES, MESSAGES])
+        elapsed = time.monotonic() - started
+        self.assertIn(
+            "Circuit breaker open after 2 consecutive failures", output.getvalue()
+        )
+        # The third attempt waited for the breaker's cooldown
+        self.assertGreaterEqual(elapsed, 0.5)
+        # 429 and 500 were retried; the 400 is not retryable and fails the row
+        self.assertIsInstance(first, RequestFailure)
+        self.assertEqual(first.attempts, 3)
+        self.assertEqual(first.error.status_code, 400)
+        self.assertEqual(engine.retries, 2)
+        self.assertEqual(engine.failures, 1)
+        # The script is used up, so the next row succeeds
+        self.assertNotIsInstance(second, RequestFailure)
+
+
+if __name__ == "__main__":
+    unittest.main()